@@ -1,18 +1,149 @@
 __author__ = 'olivierf'
+import hashlib
+import json
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
 from pypodio2 import api, transport
 from models import PodioKey
+from encryption import Encryptor
+
+PODIO_DOMAIN = 'https://api.podio.com'
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+# cache key: token (as a dictionary)
+_tokens = {}
+# cache key: RateLimiter shared by the clients of a Podio key
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_http_pool():
+    """
+    HTTP connections pool shared by every PodioApi of the process
+    """
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = transport.HttpPool(max_size=int(getattr(settings, 'PSYNC_HTTP_POOL_SIZE', 10)),
+                                            idle_timeout=int(getattr(settings, 'PSYNC_HTTP_IDLE_TIMEOUT', 60)),
+                                            per_host=int(getattr(settings, 'PSYNC_HTTP_PER_HOST', 4)),
+                                            timeout=getattr(settings, 'PSYNC_HTTP_TIMEOUT', 60))
+        return _http_pool
+
+
+def get_token_cache_key(podio_details):
+    credentials = '%s:%s' % (podio_details.client_id, podio_details.podio_user.user_name)
+    return 'psync_token_%s_%s' % (podio_details.pk, hashlib.md5(credentials.encode('utf-8')).hexdigest())
+
+
+def encrypt_token(token_dict):
+    """
+    Encrypt a token (as a dictionary) before it is stored in the PSYNC_TOKEN_CACHE cache, with the SECRET_KEY
+    """
+    return Encryptor().encrypt(json.dumps(token_dict))
+
+
+def decrypt_token(value):
+    """
+    :param value: value stored in the PSYNC_TOKEN_CACHE cache (see encrypt_token)
+    :return: token as a dictionary, or None if the value cannot be decrypted
+    """
+    if value is None:
+        return None
+    try:
+        return json.loads(Encryptor().decrypt(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_cached_token(cache_key):
+    """
+    Return the token stored for a Podio key, in the PSYNC_TOKEN_CACHE cache or in this process.
+    The cache comes first, it holds the tokens refreshed by the other processes.
+    :param cache_key: see get_token_cache_key
+    :return: OAuthToken or None if no valid token is stored
+    """
+    token = None
+    cache_alias = getattr(settings, 'PSYNC_TOKEN_CACHE', None)
+    if cache_alias:
+        token = decrypt_token(caches[cache_alias].get(cache_key))
+    if token is None:
+        token = _tokens.get(cache_key)
+    if token and token['expires_at'] > time.time():
+        return transport.OAuthToken(token)
+
+
+def store_token(cache_key, token):
+    """
+    Keep a token for the next PodioApi objects created with the same Podio key.
+    The token is encrypted before it is stored in the PSYNC_TOKEN_CACHE cache.
+    :param cache_key: see get_token_cache_key
+    :param token: OAuthToken
+    """
+    _tokens[cache_key] = token.to_dict()
+    cache_alias = getattr(settings, 'PSYNC_TOKEN_CACHE', None)
+    if cache_alias:
+        caches[cache_alias].set(cache_key, encrypt_token(token.to_dict()),
+                                max(1, int(token.expires_at - time.time())))
+
+
+def drop_token(cache_key, token):
+    """
+    Forget a token Podio does not accept anymore, unless it was already replaced
+    :param cache_key: see get_token_cache_key
+    :param token: OAuthToken
+    """
+    if _tokens.get(cache_key, {}).get('access_token') == token.access_token:
+        _tokens.pop(cache_key, None)
+    cache_alias = getattr(settings, 'PSYNC_TOKEN_CACHE', None)
+    if cache_alias:
+        cache = caches[cache_alias]
+        if (decrypt_token(cache.get(cache_key)) or {}).get('access_token') == token.access_token:
+            cache.delete(cache_key)
+
+
+def get_rate_limiter(cache_key):
+    with _rate_limiters_lock:
+        if cache_key not in _rate_limiters:
+            _rate_limiters[cache_key] = transport.RateLimiter(
+                budget=float(getattr(settings, 'PSYNC_RATE_LIMIT_BUDGET', 0.95)))
+        return _rate_limiters[cache_key]
 
 
 class PodioApi(object):
+    """
+    Podio client for a user. The OAuth token is reused from a previous PodioApi when possible
+    and refreshed before it expires, or when Podio rejects it.
+    """
     def __init__(self, username):
         try:
-            podio_details = PodioKey.objects.get(podio_user__user_name='%s' % username)
-            self.auth = api.OAuthClient(podio_details.client_id,
-                                        podio_details.client_secret,
-                                        podio_details.podio_user.user_name,
-                                        podio_details.podio_user.user_password,)
+            podio_details = PodioKey.objects.select_related('podio_user').get(podio_user__user_name='%s' % username)
+            cache_key = get_token_cache_key(podio_details)
+            token = get_cached_token(cache_key)
+            authorization = transport.OAuthAuthorization(podio_details.podio_user.user_name,
+                                                         podio_details.podio_user.user_password,
+                                                         podio_details.client_id,
+                                                         podio_details.client_secret,
+                                                         PODIO_DOMAIN,
+                                                         pool=get_http_pool(),
+                                                         token=token,
+                                                         refresh_margin=int(getattr(settings,
+                                                                                    'PSYNC_TOKEN_REFRESH_MARGIN',
+                                                                                    300)),
+                                                         on_refresh=lambda new_token: store_token(cache_key,
+                                                                                                  new_token),
+                                                         on_reject=lambda old_token: drop_token(cache_key, old_token))
+            if token is None:
+                store_token(cache_key, authorization.token)
+            self.auth = api.AuthorizingClient(PODIO_DOMAIN, authorization,
+                                              pool=get_http_pool(),
+                                              rate_limiter=get_rate_limiter(cache_key),
+                                              max_retries=int(getattr(settings, 'PSYNC_HTTP_MAX_RETRIES', 5)))
         except PodioKey.DoesNotExist:
             self.auth = None
         except transport.TransportException:
             self.auth = None
-
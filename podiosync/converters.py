@@ -0,0 +1,162 @@
+import datetime
+import hashlib
+import logging
+
+import pytz
+from dateutil import parser
+from django.utils.encoding import force_text
+
+logger = logging.getLogger(__name__)
+
+
+def parse_podio_datetime(value):
+    """
+    Parse a date sent by podio ('YYYY-MM-DD HH:MM:SS', UTC) into an aware datetime.
+    Other formats are handed to dateutil.
+    :param value: string
+    :return: aware datetime (UTC)
+    """
+    try:
+        if len(value) == 19 and value[4] == '-' and value[10] == ' ':
+            return datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                     int(value[11:13]), int(value[14:16]), int(value[17:19]), tzinfo=pytz.utc)
+    except ValueError:
+        pass
+    return pytz.utc.localize(parser.parse(value))
+
+
+def _join(values):
+    return u', '.join(values)
+
+
+def _date_start(values):
+    return parse_podio_datetime(values[0]['start'])
+
+
+def _date_end(values):
+    if 'end' in values[0]:
+        return parse_podio_datetime(values[0]['end'])
+    return None
+
+
+def _first_value(values):
+    return force_text(values[0]['value'])
+
+
+def _all_values(values):
+    return _join([force_text(val['value']) for val in values])
+
+
+def _category(values):
+    return _join([force_text(val['value']['text']) for val in values])
+
+
+def _money_currency(values):
+    return force_text(values[0]['currency'])
+
+
+def _contact(values):
+    return _join([force_text(val['value']['name']) for val in values])
+
+
+def _app_title(values):
+    return _join([force_text(val['value']['title']) for val in values])
+
+
+def _app_reference(values):
+    return _join([str(int(val['value']['item_id'])) for val in values])
+
+
+def _image(values):
+    return values[0]['value']['link']
+
+
+def _location(values):
+    return values[0]['formatted']
+
+
+def _unknown(values):
+    return u''
+
+
+# podio field type: list of (column suffix, extractor), the columns generate_fields creates for that type
+FIELD_COLUMNS = {
+    'text': [('', _first_value)],
+    'number': [('', _all_values)],
+    'progress': [('', _all_values)],
+    'category': [('', _category)],
+    'email': [('', _all_values)],
+    'phone': [('', _all_values)],
+    'money': [('', _first_value), ('_currency', _money_currency)],
+    'duration': [('', _all_values)],
+    'contact': [('', _contact)],
+    'app': [('', _app_title), ('_ref', _app_reference)],
+    'image': [('', _image)],
+    'location': [('', _location)],
+    'date': [('', _date_start), ('_end', _date_end)],
+}
+
+
+class RowConverter(object):
+    """
+    Converter from podio items to rows of the application table, compiled once from the application fields.
+    Calling it with an item returns a tuple of values, in the order of the columns attribute.
+    Columns of the fields missing from the item (empty in podio) are set to None.
+    date_edited is the date of the current revision of the item in podio.
+    The last column, row_hash, is a hash of the field values, used to skip the rows that did not change.
+    """
+
+    def __init__(self, app_fields):
+        self.app_fields = app_fields
+        self.columns = ['item_id', 'date_updated', 'date_edited']
+        # external_id: list of (column index, extractor)
+        self._extractors = {}
+        for field in app_fields:
+            if field['status'] == 'deleted':
+                continue
+            extractors = []
+            for suffix, extractor in FIELD_COLUMNS.get(field['type'], [('', _unknown)]):
+                extractors.append((len(self.columns), extractor))
+                self.columns.append('%s%s' % (field['external_id'], suffix))
+            self._extractors[field['external_id']] = extractors
+        self.columns.append('row_hash')
+
+    def __getstate__(self):
+        # the extractors are rebuilt from the fields, e.g. when sent to another process
+        return {'app_fields': self.app_fields}
+
+    def __setstate__(self, state):
+        self.__init__(state['app_fields'])
+
+    def __call__(self, item, date_updated=None):
+        """
+        :param item: item as returned by podio
+        :param date_updated: value of the date_updated column, now if None
+        :return: tuple of values
+        """
+        row = [None] * (len(self.columns) - 1)
+        row[0] = item['item_id']
+        row[1] = date_updated or datetime.datetime.now(pytz.utc)
+        row[2] = parse_podio_datetime(item['current_revision']['created_on'])
+        for field in item['fields']:
+            extractors = self._extractors.get(field['external_id'])
+            if extractors is None:
+                continue
+            values = field['values']
+            for index, extractor in extractors:
+                try:
+                    row[index] = extractor(values)
+                except Exception as e:
+                    logger.error('%s: %s' % (field['external_id'], e))
+                    row[index] = None if extractor in (_date_start, _date_end) else u''
+        row.append(row_hash(row[3:]))
+        return tuple(row)
+
+
+def row_hash(values):
+    """
+    Compact hash of the values of a row
+    :param values: list of values
+    :return: hexadecimal string (32 characters)
+    """
+    return hashlib.md5(repr(values).encode('utf-8')).hexdigest()
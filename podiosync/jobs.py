@@ -0,0 +1,146 @@
+import datetime
+import logging
+import threading
+import time
+
+from django.db import transaction
+
+from podiosync.leases import ApplicationLease, LeaseUnavailable, get_lease_duration, lease_available, utc_now
+from podiosync.models import ApplicationSync, SyncJob
+from podiosync.utils import sync_application
+
+logger = logging.getLogger(__name__)
+
+
+def requeue_stale_jobs():
+    """
+    Put back in the queue the jobs left running by a worker that died: nobody holds the lease on their application
+    although they started more than a lease duration ago.
+    :return: number of jobs queued again
+    """
+    now = utc_now()
+    return (SyncJob.objects.filter(status='running', started__lt=now - datetime.timedelta(seconds=get_lease_duration()))
+            .filter(lease_available(now, prefix='application__'))
+            .update(status='queued', started=None))
+
+
+def submit_job(app_sync, full_sync=False):
+    """
+    Queue the sync of an application. If a sync of the application is already queued or running, that job is
+    returned instead of queuing another one (a queued job is upgraded to a full sync if one is requested). Jobs left
+    running by a dead worker are queued again first.
+    :param app_sync: ApplicationSync object
+    :param full_sync: (True/False). Passed to sync_application
+    :return: SyncJob object
+    """
+    requeue_stale_jobs()
+    with transaction.atomic():
+        # the application row serialises the requests made for the same application
+        ApplicationSync.objects.select_for_update().filter(pk=app_sync.pk).first()
+        job = SyncJob.objects.filter(application=app_sync, status__in=('queued', 'running')).order_by('id').first()
+        if job is None:
+            job = SyncJob.objects.create(application=app_sync, full_sync=full_sync)
+        elif full_sync and not job.full_sync and job.status == 'queued':
+            job.full_sync = True
+            job.save(update_fields=['full_sync'])
+    return job
+
+
+def claim_job():
+    """
+    Take the oldest queued job of an application not being synchronised, several workers can call it at the
+    same time. Jobs left running by a dead worker are queued again first.
+    :return: SyncJob object (now running) or None if no job is queued
+    """
+    if requeue_stale_jobs():
+        logger.info('Jobs left running by a stopped worker queued again')
+    while True:
+        now = utc_now()
+        job = (SyncJob.objects.filter(status='queued')
+               .filter(lease_available(now, prefix='application__'))
+               .select_related('application__podio_key__podio_user')
+               .order_by('id').first())
+        if job is None:
+            return None
+        # only one worker changes the status of the job, the other ones try the next job
+        if SyncJob.objects.filter(pk=job.pk, status='queued').update(status='running', started=now):
+            job.status = 'running'
+            job.started = now
+            return job
+
+
+class JobProgress(object):
+    """
+    Progress callback of sync_application saving the counters of a job.
+    Counters are saved at most every `interval` seconds, and only from the thread running the job (the pages are
+    fetched by other threads, which do not have to open a DB connection).
+    """
+
+    def __init__(self, job, interval=1):
+        self.job = job
+        self.interval = interval
+        self.thread = threading.current_thread()
+        self.counters = {}
+        self.saved = 0
+
+    def __call__(self, **counters):
+        self.counters.update(counters)
+        if threading.current_thread() is self.thread and time.time() - self.saved >= self.interval:
+            self.save()
+
+    def save(self):
+        if self.counters:
+            SyncJob.objects.filter(pk=self.job.pk).update(**self.counters)
+        self.saved = time.time()
+
+
+def run_job(job):
+    """
+    Run a job claimed by claim_job and record its result.
+    If another worker is synchronising the application, the job is queued again and the result is 'busy'.
+    :param job: SyncJob object
+    :return: dictionary with message, as returned by sync_application
+    """
+    progress = JobProgress(job)
+    msg = {'result': 'error'}
+    running_jobs = SyncJob.objects.filter(pk=job.pk, status='running')
+    try:
+        job = SyncJob.objects.select_related('application__podio_key__podio_user').get(pk=job.pk)
+        # once queued again by requeue_stale_jobs and claimed by another worker, the job is not ours anymore
+        running_jobs = running_jobs.filter(started=job.started)
+        app_sync = job.application
+        with ApplicationLease(app_sync) as lease:
+            msg = sync_application(app_sync.application_id, app_sync.podio_key.podio_user.user_name,
+                                   full_sync=job.full_sync, progress=progress, lease=lease)
+    except LeaseUnavailable as e:
+        logger.info(str(e))
+        running_jobs.update(status='queued', started=None)
+        return {'result': 'busy'}
+    except Exception as e:
+        logger.error(str(e))
+    progress.save()
+    running_jobs.update(status='success' if msg['result'] == 'success' else 'error', finished=utc_now())
+    return msg
+
+
+def get_job_status(job):
+    """
+    Progress of a job, with an estimate of the time left while it runs
+    :param job: SyncJob object
+    :return: dictionary
+    """
+    status = {'job_id': job.pk,
+              'application_id': job.application.application_id,
+              'status': job.status,
+              'pages_fetched': job.pages_fetched,
+              'items_total': job.items_total,
+              'items_written': job.items_written,
+              'items_skipped': job.items_skipped,
+              'eta': None}
+    items_done = job.items_written + job.items_skipped
+    if job.status == 'running' and job.started and job.items_total and items_done:
+        elapsed = (utc_now() - job.started).total_seconds()
+        status['eta'] = int(elapsed * max(0, job.items_total - items_done) / items_done)
+    if job.status == 'success' and job.application.last_synced:
+        status['last_synced'] = job.application.last_synced.strftime('%b %d, %Y, %I:%M %p')
+    return status
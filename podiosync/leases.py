@@ -0,0 +1,147 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+import pytz
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+from podiosync.models import ApplicationSync
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseUnavailable(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def utc_now():
+    return pytz.utc.localize(datetime.datetime.utcnow())
+
+
+def get_lease_duration():
+    return int(getattr(settings, 'PSYNC_LEASE_DURATION', 300))
+
+
+def new_owner():
+    """
+    :return: string identifying a lease holder, unique across hosts and processes
+    """
+    return '%s:%s:%s' % (socket.gethostname()[:60], os.getpid(), uuid.uuid4().hex[:12])
+
+
+def lease_available(now, prefix=''):
+    """
+    :param now: aware datetime
+    :param prefix: path to the application from the model queried, e.g. 'application__'
+    :return: Q object selecting the applications nobody holds a valid lease on
+    """
+    return (Q(**{prefix + 'lease_owner__isnull': True}) | Q(**{prefix + 'lease_expires__isnull': True}) |
+            Q(**{prefix + 'lease_expires__lt': now}))
+
+
+def claim_lease(app_pk, owner, duration):
+    """
+    Take the lease on an application if nobody holds it or if it expired. A single conditional UPDATE does it,
+    so only one worker can succeed.
+    :param app_pk: ApplicationSync primary key
+    :param owner: lease holder, see new_owner
+    :param duration: number of seconds the lease is valid for
+    :return: True if the lease was taken
+    """
+    now = utc_now()
+    return ApplicationSync.objects.filter(lease_available(now) | Q(lease_owner=owner), pk=app_pk).update(
+        lease_owner=owner, lease_expires=now + datetime.timedelta(seconds=duration)) == 1
+
+
+def renew_lease(app_pk, owner, duration):
+    """
+    :return: True if the lease was still held by owner and is extended
+    """
+    return ApplicationSync.objects.filter(pk=app_pk, lease_owner=owner).update(
+        lease_expires=utc_now() + datetime.timedelta(seconds=duration)) == 1
+
+
+def release_lease(app_pk, owner):
+    ApplicationSync.objects.filter(pk=app_pk, lease_owner=owner).update(lease_owner=None, lease_expires=None)
+
+
+class ApplicationLease(object):
+    """
+    Context manager holding the lease on an application, so that no other worker (on this host or another one)
+    synchronises it meanwhile. The lease is renewed by a thread every third of its duration and released on exit.
+    If the worker dies, the lease expires after `duration` seconds and another worker can take it. The same happens
+    to a sync past its deadline (e.g. stuck on a request), the lease is not renewed anymore.
+
+        with ApplicationLease(app_sync) as lease:
+            sync_application(..., lease=lease)
+
+    Once the lease is lost, another worker may be synchronising the application: the code holding the lease calls
+    check before writing, and stops.
+
+    :param deadline: timestamp (time.time()) after which the lease is not renewed, None to renew it until exit
+    :raises LeaseUnavailable: on enter, if another worker holds the lease
+    """
+
+    def __init__(self, app_sync, duration=None, owner=None, deadline=None):
+        self.app_pk = app_sync.pk
+        self.duration = duration or get_lease_duration()
+        self.owner = owner or new_owner()
+        self.deadline = deadline
+        self.lost = threading.Event()
+        # time.time() at which the lease expires if it is not renewed
+        self.expires = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        :raises LeaseLost: if another worker took the lease, or if it expired because it could not be renewed
+        """
+        if self.lost.is_set() or time.time() >= self.expires:
+            raise LeaseLost('Lease on application %s lost by %s' % (self.app_pk, self.owner))
+
+    def __enter__(self):
+        expires = time.time() + self.duration
+        if not claim_lease(self.app_pk, self.owner, self.duration):
+            raise LeaseUnavailable('Application %s is being synchronised by another worker' % self.app_pk)
+        self.expires = expires
+        self._thread = threading.Thread(target=self._heartbeat, name='psync-lease-%s' % self.app_pk)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        release_lease(self.app_pk, self.owner)
+        return False
+
+    def _heartbeat(self):
+        try:
+            while not self._stop.wait(self.duration / 3.0):
+                if self.deadline and time.time() > self.deadline:
+                    logger.error('Sync of application %s past its deadline, lease not renewed' % self.app_pk)
+                    return
+                try:
+                    expires = time.time() + self.duration
+                    if not renew_lease(self.app_pk, self.owner, self.duration):
+                        logger.error('Lease on application %s lost by %s' % (self.app_pk, self.owner))
+                        self.lost.set()
+                        return
+                    self.expires = expires
+                except Exception as e:
+                    # the DB may be back before the lease expires
+                    logger.error(str(e))
+        finally:
+            # every thread has its own DB connection
+            connections.close_all()
@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from podiosync.models import ApplicationSync
+from podiosync.pipeline import start_transform_pool
+from podiosync.webhooks import apply_events, register_hooks
+
+
+class Command(BaseCommand):
+    help = 'Register the podio hooks of the enabled applications, or apply the events received from them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['register', 'apply'],
+                            help='register: create and verify the hooks, apply: update the items changed in podio')
+        parser.add_argument('application_ids', nargs='*', type=int,
+                            help='Only these applications (Podio application IDs)')
+        parser.add_argument('--url', default=None,
+                            help='Public URL of this site, podio sends the events there (PSYNC_WEBHOOK_URL)')
+        parser.add_argument('--loop', type=int, default=None, metavar='SECONDS',
+                            help='Keep applying the events received, every SECONDS seconds')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'register':
+            self.register(options)
+            return
+        start_transform_pool()
+        if options['loop']:
+            while True:
+                self.apply(options)
+                time.sleep(options['loop'])
+        else:
+            self.apply(options)
+
+    def register(self, options):
+        if not (options['url'] or getattr(settings, 'PSYNC_WEBHOOK_URL', '')):
+            raise CommandError('The public URL of the site is needed, use --url or PSYNC_WEBHOOK_URL')
+        app_syncs = ApplicationSync.objects.filter(application_enabled=True).select_related('podio_key__podio_user')
+        if options['application_ids']:
+            app_syncs = app_syncs.filter(application_id__in=options['application_ids'])
+        for app_sync in app_syncs.order_by('application_name'):
+            msg = register_hooks(app_sync, base_url=options['url'])
+            self.stdout.write('%s (%s): %s, %s hooks created, %s verification requested' % (
+                app_sync.application_name, app_sync.application_id, msg['result'],
+                msg.get('hooks_created', 0), msg.get('hooks_verified', 0)))
+
+    def apply(self, options):
+        for summary in apply_events(application_ids=options['application_ids']):
+            app_sync = summary['application']
+            self.stdout.write('%s (%s): %s, %s items updated, %s items deleted' % (
+                app_sync.application_name, app_sync.application_id, summary['result'],
+                summary['items_updated'], summary['items_deleted']))
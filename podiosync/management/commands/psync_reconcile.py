@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from podiosync.leases import ApplicationLease, LeaseUnavailable
+from podiosync.models import ApplicationSync
+from podiosync.reconcile import reconcile_application
+
+
+class Command(BaseCommand):
+    help = 'Remove the items deleted in podio from the tables of the enabled applications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('application_ids', nargs='*', type=int,
+                            help='Only reconcile these applications (Podio application IDs)')
+
+    def handle(self, *args, **options):
+        app_syncs = ApplicationSync.objects.filter(application_enabled=True).select_related('podio_key__podio_user')
+        if options['application_ids']:
+            app_syncs = app_syncs.filter(application_id__in=options['application_ids'])
+        for app_sync in app_syncs.order_by('application_name'):
+            try:
+                with ApplicationLease(app_sync) as lease:
+                    msg = reconcile_application(app_sync.application_id, app_sync.podio_key.podio_user.user_name,
+                                                lease=lease)
+            except LeaseUnavailable:
+                msg = {'result': 'busy'}
+            self.stdout.write('%s (%s): %s, %s items deleted' % (app_sync.application_name,
+                                                                 app_sync.application_id,
+                                                                 msg['result'],
+                                                                 msg.get('items_deleted', 0)))
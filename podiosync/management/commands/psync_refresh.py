@@ -0,0 +1,60 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from podiosync.leases import ApplicationLease, LeaseUnavailable
+from podiosync.models import ApplicationSync, DeadLetterItem
+from podiosync.pipeline import start_transform_pool
+from podiosync.utils import refresh_items
+
+
+class Command(BaseCommand):
+    help = 'Retrieve some items of an application from podio and update them in its table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('application_id', type=int, help='Podio application ID')
+        parser.add_argument('item_ids', nargs='*', type=int, help='Podio item IDs')
+        parser.add_argument('--file', default=None,
+                            help='Read the item IDs from this file (one per line, - for the standard input)')
+        parser.add_argument('--delete-missing', action='store_true', default=False, dest='delete_missing',
+                            help='Delete from the table the items not found in podio')
+        parser.add_argument('--dead-letters', action='store_true', default=False, dest='dead_letters',
+                            help='Also retry the items that could not be updated by previous syncs')
+
+    def handle(self, *args, **options):
+        start_transform_pool()
+        try:
+            app_sync = ApplicationSync.objects.select_related('podio_key__podio_user').get(
+                application_id=options['application_id'])
+        except ApplicationSync.DoesNotExist:
+            raise CommandError('Application %s is not set up' % options['application_id'])
+        item_ids = set(options['item_ids'])
+        if options['file']:
+            lines = sys.stdin if options['file'] == '-' else open(options['file'])
+            try:
+                item_ids.update(int(line) for line in lines if line.strip())
+            except ValueError as e:
+                raise CommandError('Invalid item ID: %s' % e)
+            finally:
+                if lines is not sys.stdin:
+                    lines.close()
+        dead_letters = DeadLetterItem.objects.filter(application=app_sync).exclude(item_id=None)
+        dead_letter_ids = []
+        if options['dead_letters']:
+            dead_letter_ids = list(dead_letters.values_list('id', flat=True))
+            item_ids.update(dead_letters.values_list('item_id', flat=True))
+        if not item_ids:
+            raise CommandError('No item ID given')
+
+        try:
+            with ApplicationLease(app_sync) as lease:
+                msg = refresh_items(app_sync.application_id, app_sync.podio_key.podio_user.user_name, item_ids,
+                                    delete_missing=options['delete_missing'], lease=lease)
+        except LeaseUnavailable as e:
+            raise CommandError('%s, try again later' % e)
+        if msg['result'] == 'success':
+            # the items failing again are back in the dead letters
+            dead_letters.filter(id__in=dead_letter_ids).delete()
+        self.stdout.write('%s (%s): %s, %s items updated, %s items not found in podio, %s items deleted' % (
+            app_sync.application_name, app_sync.application_id, msg['result'], msg.get('items_updated', 0),
+            msg.get('items_missing', 0), msg.get('items_deleted', 0)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from podiosync.pipeline import start_transform_pool
+from podiosync.scheduler import run_scheduler
+
+
+class Command(BaseCommand):
+    help = 'Keep synchronising the enabled applications, more often the ones that change the most'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of applications synchronised at the same time')
+        parser.add_argument('--per-key', type=int, default=None, dest='per_key',
+                            help='Maximum number of applications synchronised at the same time with one Podio key')
+        parser.add_argument('--timeout', type=int, default=None,
+                            help='Number of seconds after which an application sync is stopped')
+
+    def handle(self, *args, **options):
+        start_transform_pool()
+
+        def on_sync(summary, interval):
+            app_sync = summary['application']
+            self.stdout.write('%s (%s): %s, %s items updated in %.1fs, next sync in %ss' % (
+                app_sync.application_name, app_sync.application_id, summary['result'], summary['items_updated'],
+                summary['duration'], interval))
+
+        try:
+            run_scheduler(workers=options['workers'], per_key=options['per_key'], timeout=options['timeout'],
+                          on_sync=on_sync)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
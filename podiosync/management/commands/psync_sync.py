@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from podiosync.models import ApplicationSync
+from podiosync.pipeline import start_transform_pool
+from podiosync.runner import sync_applications
+
+
+class Command(BaseCommand):
+    help = 'Synchronise every enabled application, several at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('application_ids', nargs='*', type=int,
+                            help='Only synchronise these applications (Podio application IDs)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of applications synchronised at the same time')
+        parser.add_argument('--per-key', type=int, default=None, dest='per_key',
+                            help='Maximum number of applications synchronised at the same time with one Podio key')
+        parser.add_argument('--timeout', type=int, default=None,
+                            help='Number of seconds after which an application sync is stopped')
+        parser.add_argument('--full', action='store_true', default=False,
+                            help='Fetch every item rather than the ones edited since the last sync')
+        parser.add_argument('--reload', action='store_true', default=False,
+                            help='Load every item in a new table and swap it in for the application table')
+
+    def handle(self, *args, **options):
+        start_transform_pool()
+        app_syncs = ApplicationSync.objects.filter(application_enabled=True).select_related('podio_key__podio_user')
+        if options['application_ids']:
+            app_syncs = app_syncs.filter(application_id__in=options['application_ids'])
+        app_syncs = list(app_syncs.order_by('application_name'))
+        if not app_syncs:
+            self.stdout.write('No application to synchronise')
+            return
+
+        summaries = sync_applications(app_syncs,
+                                      workers=options['workers'],
+                                      per_key=options['per_key'],
+                                      timeout=options['timeout'],
+                                      full_sync=options['full'],
+                                      reload=options['reload'])
+
+        row_format = '%-40s %12s %-8s %10s %10s'
+        self.stdout.write(row_format % ('Application', 'ID', 'Result', 'Items', 'Seconds'))
+        for summary in summaries:
+            app_sync = summary['application']
+            self.stdout.write(row_format % (app_sync.application_name[:40],
+                                            app_sync.application_id,
+                                            summary['result'],
+                                            summary['items_updated'],
+                                            '%.1f' % summary['duration']))
+        failed = len([summary for summary in summaries if summary['result'] != 'success'])
+        self.stdout.write('%s applications synchronised, %s failed' % (len(summaries) - failed, failed))
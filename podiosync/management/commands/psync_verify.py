@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from podiosync.leases import ApplicationLease, LeaseUnavailable
+from podiosync.models import ApplicationSync
+from podiosync.pipeline import start_transform_pool
+from podiosync.reconcile import verify_application
+
+
+class Command(BaseCommand):
+    help = 'Compare the tables of the enabled applications with podio and update the items that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('application_ids', nargs='*', type=int,
+                            help='Only verify these applications (Podio application IDs)')
+        parser.add_argument('--min-span', type=int, dest='min_span',
+                            help='Smallest range of edit dates compared, in seconds (PSYNC_VERIFY_MIN_SPAN)')
+        parser.add_argument('--bucket', type=int, dest='bucket',
+                            help='Size of the ranges of edit dates first compared, in seconds (PSYNC_VERIFY_BUCKET)')
+
+    def handle(self, *args, **options):
+        start_transform_pool()
+        app_syncs = ApplicationSync.objects.filter(application_enabled=True).select_related('podio_key__podio_user')
+        if options['application_ids']:
+            app_syncs = app_syncs.filter(application_id__in=options['application_ids'])
+        for app_sync in app_syncs.order_by('application_name'):
+            try:
+                with ApplicationLease(app_sync) as lease:
+                    msg = verify_application(app_sync.application_id, app_sync.podio_key.podio_user.user_name,
+                                             min_span=options['min_span'], bucket=options['bucket'],
+                                             lease=lease)
+            except LeaseUnavailable:
+                msg = {'result': 'busy'}
+            self.stdout.write('%s (%s): %s, %s items updated in %s ranges' % (app_sync.application_name,
+                                                                             app_sync.application_id,
+                                                                             msg['result'],
+                                                                             msg.get('items_updated', 0),
+                                                                             msg.get('ranges_refetched', 0)))
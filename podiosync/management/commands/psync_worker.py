@@ -0,0 +1,56 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from podiosync.jobs import claim_job, run_job
+from podiosync.pipeline import start_transform_pool
+
+
+class Command(BaseCommand):
+    help = 'Run the syncs queued from the UI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of jobs run at the same time (PSYNC_WORKER_THREADS)')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Stop once no job is queued rather than waiting for new ones')
+
+    def handle(self, *args, **options):
+        start_transform_pool()
+        workers = options['workers'] or int(getattr(settings, 'PSYNC_WORKER_THREADS', 1))
+        poll = int(getattr(settings, 'PSYNC_WORKER_POLL', 5))
+        threads = [threading.Thread(target=self.work, args=(poll, options['once'])) for i in range(max(1, workers))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # joining with a timeout keeps the main thread responsive to Ctrl+C
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1)
+
+    def work(self, poll, once):
+        try:
+            while True:
+                job = claim_job()
+                if job is None:
+                    if once:
+                        return
+                    time.sleep(poll)
+                    continue
+                app_sync = job.application
+                msg = run_job(job)
+                if msg['result'] == 'busy':
+                    # another worker is synchronising the application, the job is run once it is done
+                    time.sleep(poll)
+                    continue
+                self.stdout.write('%s (%s): job %s %s, %s items updated' % (app_sync.application_name,
+                                                                            app_sync.application_id,
+                                                                            job.pk,
+                                                                            msg['result'],
+                                                                            msg.get('items_updated', 0)))
+        finally:
+            # every thread has its own DB connection
+            connections.close_all()
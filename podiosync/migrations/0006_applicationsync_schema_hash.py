@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('podiosync', '0005_applicationsync_podio_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsync',
+            name='schema_hash',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
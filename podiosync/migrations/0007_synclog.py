@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('podiosync', '0006_applicationsync_schema_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsync',
+            name='application_url',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name='SyncLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('result', models.CharField(choices=[('SUCCESS', 'Success'), ('INFO', 'Info'), ('ERROR', 'Error')], max_length=100)),
+                ('section', models.CharField(choices=[('SQL', 'SQL Create/Modify'), ('PODIO', 'PODIO Connectivity'), ('UPDATE', 'Updating data'), ('SYSTEM', 'System')], max_length=100)),
+                ('message', models.TextField()),
+                ('items_written', models.IntegerField(blank=True, null=True)),
+                ('items_skipped', models.IntegerField(blank=True, null=True)),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='podiosync.ApplicationSync')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('podiosync', '0007_synclog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('item_id', models.IntegerField()),
+                ('event_type', models.CharField(choices=[('item.create', 'Item created'), ('item.update', 'Item updated'), ('item.delete', 'Item deleted')], max_length=50)),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='podiosync.ApplicationSync')),
+            ],
+        ),
+    ]
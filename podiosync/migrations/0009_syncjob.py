@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('podiosync', '0008_webhookevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('full_sync', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('success', 'Success'), ('error', 'Error')], db_index=True, default='queued', max_length=20)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('pages_fetched', models.IntegerField(default=0)),
+                ('items_total', models.IntegerField(blank=True, null=True)),
+                ('items_written', models.IntegerField(default=0)),
+                ('items_skipped', models.IntegerField(default=0)),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='podiosync.ApplicationSync')),
+            ],
+        ),
+    ]
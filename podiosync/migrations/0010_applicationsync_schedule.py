@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('podiosync', '0009_syncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsync',
+            name='next_sync',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationsync',
+            name='sync_interval',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
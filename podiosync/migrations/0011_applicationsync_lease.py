@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('podiosync', '0010_applicationsync_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsync',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationsync',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
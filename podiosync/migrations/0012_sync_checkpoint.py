@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('podiosync', '0011_applicationsync_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsync',
+            name='sync_run_id',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationsync',
+            name='sync_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationsync',
+            name='sync_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='applicationsync',
+            name='sync_cursor',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DeadLetterItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('item_id', models.IntegerField(blank=True, null=True)),
+                ('sync_run_id', models.CharField(blank=True, max_length=32, null=True)),
+                ('error', models.TextField()),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='podiosync.ApplicationSync')),
+            ],
+        ),
+    ]
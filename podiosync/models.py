@@ -55,6 +55,16 @@ class ApplicationSync(models.Model):
     last_synced = models.DateTimeField(blank=True, null=True)
     podio_key = models.ForeignKey(PodioKey)
     application_url = models.CharField(max_length=255, blank=True, null=True)
+    schema_hash = models.CharField(max_length=40, blank=True, null=True)
+    next_sync = models.DateTimeField(blank=True, null=True)
+    sync_interval = models.IntegerField(blank=True, null=True)
+    lease_owner = models.CharField(max_length=100, blank=True, null=True)
+    lease_expires = models.DateTimeField(blank=True, null=True)
+    # checkpoint of the sync in progress, an interrupted sync resumes from it
+    sync_run_id = models.CharField(max_length=32, blank=True, null=True)
+    sync_started = models.DateTimeField(blank=True, null=True)
+    sync_from = models.DateTimeField(blank=True, null=True)
+    sync_cursor = models.DateTimeField(blank=True, null=True)
 
 RESULTS = (
     ('SUCCESS', 'Success'),
@@ -75,5 +85,57 @@ class SyncLog(models.Model):
     result = models.CharField(max_length=100, choices=RESULTS)
     section = models.CharField(max_length=100, choices=SECTIONS)
     message = models.TextField()
+    items_written = models.IntegerField(blank=True, null=True)
+    items_skipped = models.IntegerField(blank=True, null=True)
 
 
+HOOK_EVENTS = (
+    ('item.create', 'Item created'),
+    ('item.update', 'Item updated'),
+    ('item.delete', 'Item deleted'),
+)
+
+
+class WebhookEvent(models.Model):
+    """
+    Item changed in podio, as notified by a hook, waiting to be applied to the application table
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    application = models.ForeignKey(ApplicationSync)
+    item_id = models.IntegerField()
+    event_type = models.CharField(max_length=50, choices=HOOK_EVENTS)
+
+
+JOB_STATUSES = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('success', 'Success'),
+    ('error', 'Error'),
+)
+
+
+class SyncJob(models.Model):
+    """
+    Sync of an application requested from the UI, run by psync_worker
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    application = models.ForeignKey(ApplicationSync)
+    full_sync = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=JOB_STATUSES, default='queued', db_index=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    pages_fetched = models.IntegerField(default=0)
+    items_total = models.IntegerField(blank=True, null=True)
+    items_written = models.IntegerField(default=0)
+    items_skipped = models.IntegerField(default=0)
+
+
+class DeadLetterItem(models.Model):
+    """
+    Item that could not be converted or written during a sync, the sync goes on without it
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    application = models.ForeignKey(ApplicationSync)
+    item_id = models.IntegerField(blank=True, null=True)
+    sync_run_id = models.CharField(max_length=32, blank=True, null=True)
+    error = models.TextField()
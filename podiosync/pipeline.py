@@ -0,0 +1,161 @@
+import logging
+import threading
+from multiprocessing import Pool
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the data in a queue
+_DONE = object()
+
+# pool of processes converting items, see start_transform_pool
+_transform_pool = None
+
+
+class StageError(Exception):
+    """
+    Error raised by one stage of the pipeline ('fetch', 'transform' or 'write')
+    """
+
+    def __init__(self, stage, error):
+        super(StageError, self).__init__('%s: %s' % (stage, error))
+        self.stage = stage
+        self.error = error
+
+
+def start_transform_pool(processes=None):
+    """
+    Start the pool of processes running the transform stage of run_pipeline, once per process.
+    It must be called before the process starts any thread (e.g. at the start of a management command): the pool
+    processes are forked, and a process forked while another thread holds a lock (logging, connections pool...)
+    keeps it locked forever. If other threads are running, no pool is started and items are converted in a thread.
+    The pool is stopped when the process exits.
+    :param processes: Number of processes, PSYNC_TRANSFORM_PROCESSES if None. 0 starts no pool
+    :return: the pool, or None
+    """
+    global _transform_pool
+    if processes is None:
+        processes = int(getattr(settings, 'PSYNC_TRANSFORM_PROCESSES', 0))
+    if _transform_pool is None and processes > 0:
+        if threading.active_count() > 1:
+            logger.error('Threads are running, items are converted in a thread rather than in %s processes' %
+                         processes)
+            return None
+        # the pool processes do not use the DB, they should not share the connections of this process
+        connections.close_all()
+        _transform_pool = Pool(processes)
+    return _transform_pool
+
+
+def run_pipeline(pages, transform, write, queue_size=None, transform_pool=None):
+    """
+    Run fetch, transform and write at the same time, each one in its own thread, joined by bounded queues.
+    Fetching stops while the transform queue is full, and so on, so no more than queue_size pages wait
+    between two stages.
+    :param pages: iterable of pages, fetched in a thread (e.g. get_application_items)
+    :param transform: function called with a page and returning the data to write. It must be picklable
+                      (a module level function or a functools.partial of one) if a pool of processes runs it
+    :param write: function called with each transformed page, in the calling thread and in order
+    :param queue_size: Number of pages waiting between two stages, PSYNC_PIPELINE_QUEUE_SIZE if None
+    :param transform_pool: multiprocessing.Pool running transform, the one of start_transform_pool if None.
+                           Without pool, transform runs in a thread
+    :raises StageError: first error of any stage. The other stages are stopped, except after a fetch error: the
+                        pages fetched until then are written before it is raised
+    """
+    if queue_size is None:
+        queue_size = int(getattr(settings, 'PSYNC_PIPELINE_QUEUE_SIZE', 2))
+    if transform_pool is None:
+        transform_pool = _transform_pool
+    # with a pool of processes, as many pages as processes are transformed at once
+    transform_batch = transform_pool._processes if transform_pool is not None else 1
+    fetched = Queue(maxsize=max(1, queue_size))
+    transformed = Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+    errors = []
+    fetch_errors = []
+
+    def put(queue, value):
+        while not stop.is_set():
+            try:
+                queue.put(value, timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    def get(queue):
+        while not stop.is_set():
+            try:
+                return queue.get(timeout=0.5)
+            except Empty:
+                pass
+        return _DONE
+
+    def fail(stage, error):
+        logger.error('%s: %s' % (stage, error))
+        errors.append(StageError(stage, error))
+        stop.set()
+
+    def fetch_stage():
+        try:
+            for page in pages:
+                if not put(fetched, page):
+                    return
+        except Exception as e:
+            # the pages fetched so far are still transformed and written, the error is raised afterwards
+            logger.error('fetch: %s' % e)
+            fetch_errors.append(StageError('fetch', e))
+        put(fetched, _DONE)
+
+    def transform_stage():
+        try:
+            while True:
+                batch = []
+                page = get(fetched)
+                while page is not _DONE:
+                    batch.append(page)
+                    if len(batch) >= transform_batch:
+                        break
+                    page = get(fetched)
+                if batch:
+                    if transform_pool is not None:
+                        results = transform_pool.map(transform, batch)
+                    else:
+                        results = [transform(batch_page) for batch_page in batch]
+                    for result in results:
+                        if not put(transformed, result):
+                            return
+                if page is _DONE:
+                    put(transformed, _DONE)
+                    return
+        except Exception as e:
+            fail('transform', e)
+
+    threads = [threading.Thread(target=fetch_stage, name='psync-fetch'),
+               threading.Thread(target=transform_stage, name='psync-transform')]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            result = get(transformed)
+            if result is _DONE:
+                break
+            write(result)
+    except Exception as e:
+        fail('write', e)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    if fetch_errors:
+        raise fetch_errors[0]
@@ -3,6 +3,68 @@ from django.conf.global_settings import *
 
 PSYNC_TABLE_PREFIX = 'psync'
 
+# Number of items written to the DB per transaction
+PSYNC_BATCH_SIZE = 500
+
+# Add an index on the date_updated column of the psync tables
+PSYNC_INDEX_DATE_UPDATED = False
+
+# Number of pages of items fetched concurrently from Podio
+PSYNC_FETCH_WORKERS = 1
+
+# psync_sync command: applications synchronised at the same time, in total and per Podio key
+PSYNC_SYNC_WORKERS = 4
+PSYNC_SYNC_PER_KEY = 2
+# psync_sync command: seconds after which an application sync is stopped (None: no limit)
+PSYNC_SYNC_TIMEOUT = None
+
+# HTTP connections to Podio: requests at the same time (in total and per host), seconds before closing an idle connection
+PSYNC_HTTP_POOL_SIZE = 10
+PSYNC_HTTP_PER_HOST = 4
+PSYNC_HTTP_IDLE_TIMEOUT = 60
+# Seconds a request waits for Podio before failing (None: no limit)
+PSYNC_HTTP_TIMEOUT = 60
+
+# Podio OAuth tokens are kept in memory and, if set, in this Django cache (alias from CACHES) to be shared between processes
+# (encrypted with the SECRET_KEY)
+PSYNC_TOKEN_CACHE = None
+# Tokens are refreshed when they expire within that number of seconds
+PSYNC_TOKEN_REFRESH_MARGIN = 300
+
+# Share of Podio's rate limit used by psync, requests are paced to stay below it
+PSYNC_RATE_LIMIT_BUDGET = 0.95
+# Number of times a request refused by the rate limit (or a failed read request) is retried
+PSYNC_HTTP_MAX_RETRIES = 5
+
+# Items are fetched, converted and written at the same time: pages waiting between two of these steps
+PSYNC_PIPELINE_QUEUE_SIZE = 2
+# Number of processes converting items (0: a thread of the sync process)
+PSYNC_TRANSFORM_PROCESSES = 0
+
+# psync_verify: smallest range of edit dates (seconds) compared between podio and the table
+PSYNC_VERIFY_MIN_SPAN = 3600
+# psync_verify: size (seconds) of the ranges of edit dates first compared, each one being bisected on its own
+PSYNC_VERIFY_BUCKET = 604800
+
+# psync_scheduler: shortest and longest interval (seconds) between two syncs of an application,
+# seconds between two looks for applications to synchronise
+PSYNC_SCHEDULE_MIN_INTERVAL = 300
+PSYNC_SCHEDULE_MAX_INTERVAL = 86400
+PSYNC_SCHEDULE_TICK = 5
+
+# Number of seconds after which the lease a worker holds on an application expires if it is not renewed
+PSYNC_LEASE_DURATION = 300
+
+# psync_worker: number of queued syncs run at the same time, seconds between two looks at an empty queue
+PSYNC_WORKER_THREADS = 1
+PSYNC_WORKER_POLL = 5
+
+# Number of items requested at once when updating given items (psync_refresh, podio hooks), 500 at most
+PSYNC_REFRESH_BATCH_SIZE = 100
+
+# Public URL of the site (scheme and host), the podio hooks send their events to it
+PSYNC_WEBHOOK_URL = ''
+
 # Logging info
 # this replaces the logging from django
 LOGGING = {
@@ -0,0 +1,267 @@
+import datetime
+import logging
+
+import pytz
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Min
+
+from podiosync.api import PodioApi
+from podiosync.converters import RowConverter, parse_podio_datetime
+from podiosync.leases import LeaseLost
+from podiosync.utils import (edit_date_filter, find_items, get_application, get_application_items, get_items_by_id,
+                             get_model_for_application, log_info, update_table)
+from podiosync.writer import delete_rows
+
+logger = logging.getLogger(__name__)
+
+# number of attempts at listing the item IDs when items are created or deleted in podio meanwhile
+LIST_ATTEMPTS = 3
+# no podio item was edited before that date, start of the ranges compared by verify_application
+PODIO_EPOCH = datetime.datetime(2008, 1, 1, tzinfo=pytz.utc)
+
+
+class ListingChanged(Exception):
+    pass
+
+
+def get_application_item_ids(app_id, api_object):
+    """
+    List the IDs of every item of an application, requesting the micro view of the items only.
+    Items are sorted by creation date so that edits made meanwhile do not move them between pages.
+    :param app_id: Podio application ID
+    :param api_object: PodioApi object
+    :return: set of item IDs
+    :raises ListingChanged: if the number of items changed while listing them
+    """
+    item_ids = set()
+    dict_attributes = {'limit': 500,
+                       'sort_by': 'created_on',
+                       'sort_desc': False}
+    offset = 0
+    total = None
+    while True:
+        result = api_object.auth.Item.filter(int(app_id), dict(dict_attributes, offset=offset),
+                                             GET={'fields': 'items.view(micro)'})
+        if total is None:
+            total = result.get('filtered')
+        elif result.get('filtered') != total:
+            raise ListingChanged('Items of application %s were created or deleted while listing them' % app_id)
+        item_ids.update(item['item_id'] for item in result['items'])
+        if len(result['items']) < 500:
+            return item_ids
+        offset += 500
+
+
+def reconcile_application(app_id, api_user, database=None, lease=None):
+    """
+    Remove from the table of an application the items that do not exist in podio anymore.
+    Only the item IDs are requested from podio, which is much cheaper than a full sync. The items that were not
+    listed are requested again before being deleted.
+    :param app_id: Podio application ID
+    :param api_user: User to enable Podio API usage
+    :param database: The name of the database to use
+    :param lease: ApplicationLease held on the application, nothing is deleted if it is lost
+    :return: dictionary with message (and the number of items deleted if successful)
+    """
+    msg = {'result': 'error'}
+    if not database:
+        database = DEFAULT_DB_ALIAS
+    podio_api = PodioApi(api_user)
+    app_data = get_application(app_id, podio_api)
+    if not app_data:
+        return msg
+    model_class = get_model_for_application(app_id, app_data)
+    if not model_class:
+        return msg
+
+    podio_ids = None
+    for attempt in range(LIST_ATTEMPTS):
+        try:
+            podio_ids = get_application_item_ids(app_id, podio_api)
+            break
+        except ListingChanged as e:
+            logger.info(str(e))
+        except Exception as e:
+            logger.error(str(e))
+            log_info(app_id, 'ERROR', 'PODIO', 'Could not list items from podio: %s' % e)
+            return msg
+    if podio_ids is None:
+        log_info(app_id, 'ERROR', 'PODIO', 'Items kept changing while listing them, reconciliation cancelled')
+        return msg
+
+    local_ids = set(model_class.objects.using(database).exclude(item_id=None).values_list('item_id', flat=True))
+    deleted_ids = local_ids - podio_ids
+    # an item deleted and another one created while listing shift the pages without changing the total, and an
+    # item can be missed: only the items that podio confirms are gone are deleted
+    try:
+        found_ids = set(item['item_id'] for page in get_items_by_id(app_id, podio_api, deleted_ids) for item in page)
+        _, deleted_ids = find_items(app_id, podio_api, deleted_ids - found_ids)
+    except Exception as e:
+        logger.error(str(e))
+        log_info(app_id, 'ERROR', 'PODIO', 'Could not check the missing items in podio: %s' % e)
+        return msg
+    if lease:
+        try:
+            lease.check()
+        except LeaseLost as e:
+            logger.error(str(e))
+            return msg
+    delete_rows(model_class, deleted_ids, database=database)
+
+    msg['result'] = 'success'
+    msg['items_deleted'] = len(deleted_ids)
+    message = '%s deleted items removed from table: %s' % (len(deleted_ids), model_class._meta.db_table)
+    logger.info(message)
+    log_info(app_id, 'SUCCESS', 'SQL', message, items_written=len(deleted_ids))
+    return msg
+
+
+def count_podio_items(app_id, api_object, start, end):
+    """
+    Number of items of an application last edited in [start, end[, without retrieving the items themselves
+    :param app_id: Podio application ID
+    :param api_object: PodioApi object
+    :param start: aware datetime
+    :param end: aware datetime, podio dates have a resolution of one second
+    :return: int
+    """
+    dict_attributes = {'limit': 1,
+                       'filters': {'last_edit_on': edit_date_filter(start, end - datetime.timedelta(seconds=1))}}
+    result = api_object.auth.Item.filter(int(app_id), dict_attributes, GET={'fields': 'items.view(micro)'})
+    return result['filtered']
+
+
+def count_local_items(model_class, start, end, database):
+    return model_class.objects.using(database).filter(date_edited__gte=start, date_edited__lt=end).count()
+
+
+def get_oldest_edit_date(app_id, api_object, model_class, database):
+    """
+    Oldest edit date of the items of an application, in podio or in the table
+    :return: aware datetime, None if there is no item at all
+    """
+    dates = []
+    result = api_object.auth.Item.filter(int(app_id), {'limit': 1, 'sort_by': 'last_edit_on', 'sort_desc': False})
+    if result['items']:
+        dates.append(parse_podio_datetime(result['items'][0]['current_revision']['created_on']))
+    local_date = model_class.objects.using(database).aggregate(Min('date_edited'))['date_edited__min']
+    if local_date:
+        dates.append(local_date)
+    return min(dates) if dates else None
+
+
+def get_edit_date_buckets(start, end, size):
+    """
+    Split [start, end[ in ranges of size, aligned on PODIO_EPOCH so that the ranges stay the same from one
+    verification to the next
+    :param size: timedelta
+    :return: list of (start, end)
+    """
+    size_seconds = int(size.total_seconds())
+    bucket_start = PODIO_EPOCH + datetime.timedelta(
+        seconds=int((start - PODIO_EPOCH).total_seconds()) // size_seconds * size_seconds)
+    buckets = []
+    while bucket_start < end:
+        buckets.append((bucket_start, min(bucket_start + size, end)))
+        bucket_start += size
+    return buckets
+
+
+def find_drifted_ranges(app_id, api_object, model_class, start, end, min_span, database):
+    """
+    Compare the number of items edited in [start, end[ in podio and in the table, and split the ranges that differ
+    in two until they are shorter than min_span.
+    :param min_span: timedelta
+    :return: tuple (list of (start, end, podio count, local count) of the ranges that differ, number of counts
+             requested from podio)
+    """
+    drifted = []
+    requests = 0
+    ranges = [(start, end)]
+    while ranges:
+        range_start, range_end = ranges.pop()
+        podio_count = count_podio_items(app_id, api_object, range_start, range_end)
+        requests += 1
+        local_count = count_local_items(model_class, range_start, range_end, database)
+        if podio_count == local_count:
+            continue
+        if range_end - range_start <= min_span:
+            drifted.append((range_start, range_end, podio_count, local_count))
+            continue
+        # podio dates have a resolution of one second
+        middle = range_start + datetime.timedelta(seconds=int((range_end - range_start).total_seconds() // 2))
+        ranges.append((middle, range_end))
+        ranges.append((range_start, middle))
+    return sorted(drifted), requests
+
+
+def verify_application(app_id, api_user, database=None, min_span=None, bucket=None, lease=None):
+    """
+    Find the items edited in podio that are missing or stale in the table of an application, and update them.
+    The number of items edited in each bucket of dates is compared between podio and the table, the buckets that
+    differ are bisected, and only the items of the smallest ranges that still differ are retrieved again.
+    A stale row is counted at its old edit date in the table and at its new one in podio, it is found as long as
+    both dates fall in different buckets.
+    last_synced is left as is. Items deleted in podio are left to reconcile_application.
+    :param app_id: Podio application ID
+    :param api_user: User to enable Podio API usage
+    :param database: The name of the database to use
+    :param min_span: Smallest range of dates compared, in seconds. PSYNC_VERIFY_MIN_SPAN if None
+    :param bucket: Size of the ranges of dates first compared, in seconds. PSYNC_VERIFY_BUCKET if None
+    :param lease: ApplicationLease held on the application, the update stops if it is lost
+    :return: dictionary with message (and the number of ranges and items updated if successful)
+    """
+    msg = {'result': 'error'}
+    if not database:
+        database = DEFAULT_DB_ALIAS
+    if min_span is None:
+        min_span = int(getattr(settings, 'PSYNC_VERIFY_MIN_SPAN', 3600))
+    if bucket is None:
+        bucket = int(getattr(settings, 'PSYNC_VERIFY_BUCKET', 604800))
+    min_span = datetime.timedelta(seconds=max(1, min_span))
+    podio_api = PodioApi(api_user)
+    app_data = get_application(app_id, podio_api)
+    if not app_data:
+        return msg
+    model_class = get_model_for_application(app_id, app_data)
+    if not model_class:
+        return msg
+
+    end = datetime.datetime.now(pytz.utc).replace(microsecond=0) + datetime.timedelta(seconds=1)
+    drifted = []
+    requests = 1
+    try:
+        start = get_oldest_edit_date(app_id, podio_api, model_class, database)
+        buckets = get_edit_date_buckets(start, end, datetime.timedelta(seconds=max(1, bucket))) if start else []
+        for bucket_start, bucket_end in buckets:
+            bucket_drifted, bucket_requests = find_drifted_ranges(app_id, podio_api, model_class, bucket_start,
+                                                                  bucket_end, min_span, database)
+            drifted.extend(bucket_drifted)
+            requests += bucket_requests
+    except Exception as e:
+        logger.error(str(e))
+        log_info(app_id, 'ERROR', 'PODIO', 'Could not count items in podio: %s' % e)
+        return msg
+
+    converter = RowConverter(app_data['fields'])
+    items_updated = 0
+    for range_start, range_end, podio_count, local_count in drifted:
+        logger.info('Application %s: %s items in podio, %s in table between %s and %s' % (
+            app_id, podio_count, local_count, range_start, range_end))
+        items = get_application_items(app_id, podio_api, last_edit_from=range_start,
+                                      last_edit_to=range_end - datetime.timedelta(seconds=1), lease=lease)
+        result = update_table(model_class, app_id, items, converter, database=database, full_sync=True,
+                              record_sync=False, lease=lease)
+        if result is None:
+            return msg
+        items_updated += result['items_updated']
+
+    msg['result'] = 'success'
+    msg['ranges_refetched'] = len(drifted)
+    msg['items_updated'] = items_updated
+    message = '%s items updated in %s ranges of table: %s (%s counts requested from podio)' % (
+        items_updated, len(drifted), model_class._meta.db_table, requests)
+    logger.info(message)
+    log_info(app_id, 'SUCCESS', 'SQL', message, items_written=items_updated)
+    return msg
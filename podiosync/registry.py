@@ -0,0 +1,62 @@
+import threading
+
+from django.apps import apps
+
+
+class ModelRegistry(object):
+    """
+    Process wide registry of the models generated for Podio applications, keyed by application ID.
+    A model is only built again when the schema of its application changes, the previous one being removed
+    from the Django app registry first.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, schema_hash):
+        """
+        :return: the model registered for key if it was built for schema_hash, None otherwise
+        """
+        entry = self._models.get(key)
+        if entry and entry[0] == schema_hash:
+            return entry[1]
+
+    def get_or_create(self, key, schema_hash, factory):
+        """
+        Return the model registered for key and schema_hash, building it with factory() if needed.
+        :param key: key of the model, usually the application ID
+        :param schema_hash: fingerprint of the schema the model is built from
+        :param factory: callable returning the model (or None if it could not be built)
+        :return: the model or None if factory failed
+        """
+        with self._lock:
+            model = self.get(key, schema_hash)
+            if model is None:
+                self.discard(key)
+                model = factory()
+                if model is not None:
+                    self._models[key] = (schema_hash, model)
+            return model
+
+    def discard(self, key):
+        """
+        Forget the model registered for key and unregister it from Django
+        """
+        entry = self._models.pop(key, None)
+        if entry:
+            unregister_model(entry[1])
+
+
+def unregister_model(model):
+    """
+    Remove a generated model from the Django app registry so that a new one can be created with the same name
+    """
+    opts = model._meta
+    app_models = apps.all_models.get(opts.app_label, {})
+    if app_models.get(opts.model_name) is model:
+        del app_models[opts.model_name]
+        apps.clear_cache()
+
+
+generated_models = ModelRegistry()
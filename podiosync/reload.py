@@ -0,0 +1,204 @@
+import datetime
+import functools
+import logging
+import uuid
+
+import pytz
+from django.db import DEFAULT_DB_ALIAS, OperationalError, IntegrityError, connections, transaction
+
+from podiosync.api import PodioApi
+from podiosync.converters import RowConverter
+from podiosync.leases import LeaseLost
+from podiosync.models import ApplicationSync, DeadLetterItem
+from podiosync.pipeline import StageError, run_pipeline
+from podiosync.registry import unregister_model
+from podiosync.utils import (add_missing_indexes, build_model, create_table, get_application, get_application_items,
+                             get_model_for_application, log_info, page_to_rows)
+from podiosync.writer import get_batch_size, insert_rows
+
+logger = logging.getLogger(__name__)
+
+# shadow tables are named <table>__r<token>, see get_shadow_table
+SHADOW_MARK = '__r'
+
+
+def get_shadow_table(table_name, token):
+    return '%s%s%s' % (table_name, SHADOW_MARK, token)
+
+
+def drop_table(table_name, database):
+    connection = connections[database]
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE %s' % connection.ops.quote_name(table_name))
+
+
+def drop_shadow_tables(table_name, database):
+    """
+    Drop the shadow tables left by reloads that did not complete (e.g. the process was killed)
+    """
+    for name in connections[database].introspection.table_names():
+        if name.startswith(table_name + SHADOW_MARK):
+            logger.info('Dropping table %s' % name)
+            drop_table(name, database)
+
+
+def swap_tables(table_name, shadow_table, database):
+    """
+    Replace a table by its shadow table in a single transaction (a single statement on MySQL, where DDL statements
+    cannot be rolled back). The replaced table is dropped afterwards.
+    """
+    connection = connections[database]
+    qn = connection.ops.quote_name
+    old_table = shadow_table + '_old'
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('RENAME TABLE %s TO %s, %s TO %s' % (qn(table_name), qn(old_table),
+                                                                qn(shadow_table), qn(table_name)))
+        else:
+            with transaction.atomic(using=database):
+                cursor.execute('ALTER TABLE %s RENAME TO %s' % (qn(table_name), qn(old_table)))
+                cursor.execute('ALTER TABLE %s RENAME TO %s' % (qn(shadow_table), qn(table_name)))
+    drop_table(old_table, database)
+
+
+def reload_application(app_id, api_user, database=None, deadline=None, progress=None, lease=None):
+    """
+    Reload every item of an application into a new (shadow) table and swap it in for the application table.
+    The shadow table has no index while it is loaded, they are built once all the items are inserted. Readers of
+    the application table see the previous content until the swap, then the new one, never a partly updated table.
+    :param app_id: Podio application ID
+    :param api_user: User to enable Podio API usage
+    :param database: The name of the database to use
+    :param deadline: timestamp (time.time()) after which no more page is fetched and the reload fails
+    :param progress: function called with keyword arguments as the reload goes, see get_application_items
+    :param lease: ApplicationLease held on the application, the reload stops (before the swap) if it is lost
+    :return: dictionary with message (and the number of items loaded if successful)
+    """
+    msg = {'result': 'error'}
+    if not database:
+        database = DEFAULT_DB_ALIAS
+    sync_started = pytz.utc.localize(datetime.datetime.utcnow())
+    podio_api = PodioApi(api_user)
+    app_data = get_application(app_id, podio_api)
+    if not app_data:
+        return msg
+    # the application table is created or altered first, the shadow table replaces it with the same structure
+    model_class = get_model_for_application(app_id, app_data)
+    if not model_class:
+        return msg
+    table_name = model_class._meta.db_table
+    run_id = uuid.uuid4().hex
+    shadow_table = get_shadow_table(table_name, run_id[:8])
+    drop_shadow_tables(table_name, database)
+
+    load_model = None
+    shadow_model = None
+    swapped = False
+    try:
+        # a model without index to load the table, and one with the indexes of the application table to build them
+        load_model = build_model(app_id, app_data, suffix='_load_%s' % run_id[:8], db_table=shadow_table,
+                                 indexes=False)
+        shadow_model = build_model(app_id, app_data, suffix='_shadow_%s' % run_id[:8], db_table=shadow_table)
+        if not load_model or not shadow_model:
+            return msg
+        if not create_table(load_model, database):
+            log_info(app_id, 'ERROR', 'SQL', 'Could not create table %s' % shadow_table)
+            return msg
+        app_object = ApplicationSync.objects.get(application_id=app_id)
+        converter = RowConverter(app_data['fields'])
+        item_id_index = converter.columns.index('item_id')
+        batch_size = get_batch_size()
+        counters = {'written': 0, 'failed': 0}
+        # the same item can be returned twice by podio if it was edited while we were paging, first one wins
+        seen_ids = set()
+        rows = []
+
+        def dead_letter(item_id, error):
+            logger.error('Item %s: %s' % (item_id, error))
+            DeadLetterItem.objects.create(application=app_object, item_id=item_id, sync_run_id=run_id,
+                                          error='%s' % error)
+            counters['failed'] += 1
+
+        def flush():
+            if lease:
+                lease.check()
+            counters['written'] += insert_rows(load_model, converter.columns, rows, database=database,
+                                               batch_size=batch_size,
+                                               on_error=lambda row, e: dead_letter(row[item_id_index], e))
+            del rows[:]
+            if progress:
+                progress(items_written=counters['written'], items_skipped=0)
+
+        def write(result):
+            page_rows, failures = result
+            for item_id, error in failures:
+                dead_letter(item_id, error)
+            for row in page_rows:
+                if row[item_id_index] not in seen_ids:
+                    seen_ids.add(row[item_id_index])
+                    rows.append(row)
+            if len(rows) >= batch_size:
+                flush()
+
+        items = get_application_items(app_id, podio_api, deadline=deadline, progress=progress, lease=lease)
+        transform = functools.partial(page_to_rows, converter=converter,
+                                      last_updated=datetime.datetime(1900, 1, 1, tzinfo=pytz.utc))
+        try:
+            run_pipeline(items, transform, write)
+            if rows:
+                flush()
+        except StageError as e:
+            logger.error(str(e))
+            if e.stage == 'fetch':
+                log_info(app_id, 'ERROR', 'PODIO', 'Could not retrieve items from podio: %s' % e.error)
+            return msg
+        except (IntegrityError, OperationalError) as e:
+            logger.error(str(e))
+            log_info(app_id, 'ERROR', 'SQL', 'Could not load table %s: %s' % (shadow_table, e))
+            return msg
+        except LeaseLost as e:
+            logger.error(str(e))
+            return msg
+
+        # index names are unique in the database: they are named after the application table, which the shadow
+        # table becomes, and the run
+        if not add_missing_indexes(shadow_model, database, index_prefix='%s_%s' % (table_name, run_id[:8])):
+            log_info(app_id, 'ERROR', 'SQL', 'Could not create the indexes of table %s' % shadow_table)
+            return msg
+        try:
+            if lease:
+                lease.check()
+            swap_tables(table_name, shadow_table, database)
+            swapped = True
+        except LeaseLost as e:
+            logger.error(str(e))
+            return msg
+        except (IntegrityError, OperationalError) as e:
+            logger.error(str(e))
+            log_info(app_id, 'ERROR', 'SQL', 'Could not replace table %s: %s' % (table_name, e))
+            return msg
+    finally:
+        for model in (load_model, shadow_model):
+            if model is not None:
+                unregister_model(model)
+        if not swapped:
+            try:
+                drop_shadow_tables(table_name, database)
+            except (IntegrityError, OperationalError) as e:
+                logger.error(str(e))
+
+    if counters['failed']:
+        message = '%s items could not be loaded in table: %s, see the dead letter items of run %s' % (
+            counters['failed'], table_name, run_id)
+        logger.error(message)
+        log_info(app_id, 'ERROR', 'UPDATE', message)
+    # a sync interrupted before the reload has nothing to resume
+    ApplicationSync.objects.filter(application_id=app_id).update(last_synced=sync_started, sync_run_id=None,
+                                                                 sync_started=None, sync_from=None, sync_cursor=None)
+    message = 'Table %s reloaded with %s items (app_id: %s, app_name: %s)' % (table_name, counters['written'], app_id,
+                                                                             app_object.application_name)
+    logger.info(message)
+    log_info(app_id, 'SUCCESS', 'SQL', message, items_written=counters['written'])
+    msg['result'] = 'success'
+    msg['items_updated'] = counters['written']
+    return msg
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connections
+
+from podiosync.leases import ApplicationLease, LeaseUnavailable
+from podiosync.reload import reload_application
+from podiosync.utils import sync_application
+
+logger = logging.getLogger(__name__)
+
+
+def interleave_by_key(app_syncs):
+    """
+    Order the applications so that consecutive ones use different Podio keys where possible.
+    This prevents the pool threads from all waiting on the same key.
+    :param app_syncs: list of ApplicationSync
+    :return: list of ApplicationSync
+    """
+    by_key = OrderedDict()
+    for app_sync in app_syncs:
+        by_key.setdefault(app_sync.podio_key_id, []).append(app_sync)
+    ordered = []
+    queues = list(by_key.values())
+    while queues:
+        for queue in queues:
+            ordered.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return ordered
+
+
+def run_sync(app_sync, full_sync=False, timeout=None, reload=False):
+    """
+    Synchronise one application from a thread of a pool, closing the DB connection of the thread afterwards.
+    The application is leased meanwhile (see ApplicationLease), if another worker holds the lease the application
+    is skipped and the result is 'busy'.
+    :param app_sync: ApplicationSync to synchronise
+    :param full_sync: (True/False). Passed to sync_application
+    :param timeout: Number of seconds after which the sync is stopped, no limit if None
+    :param reload: (True/False). If set to True, the table is reloaded with reload_application rather than updated
+    :return: dictionary (application, result, items_updated, duration)
+    """
+    summary = {'application': app_sync, 'result': 'error', 'items_updated': 0, 'duration': 0}
+    started = time.time()
+    try:
+        deadline = started + timeout if timeout else None
+        with ApplicationLease(app_sync, deadline=deadline) as lease:
+            if reload:
+                msg = reload_application(app_sync.application_id, app_sync.podio_key.podio_user.user_name,
+                                         deadline=deadline, lease=lease)
+            else:
+                msg = sync_application(app_sync.application_id, app_sync.podio_key.podio_user.user_name,
+                                       full_sync=full_sync, deadline=deadline, lease=lease)
+        summary['result'] = msg['result']
+        summary['items_updated'] = msg.get('items_updated', 0)
+    except LeaseUnavailable as e:
+        logger.info(str(e))
+        summary['result'] = 'busy'
+    except Exception as e:
+        logger.error(str(e))
+    finally:
+        # every thread has its own DB connection
+        connections.close_all()
+    summary['duration'] = time.time() - started
+    return summary
+
+
+def sync_applications(app_syncs, workers=None, per_key=None, timeout=None, full_sync=False, reload=False):
+    """
+    Synchronise several applications at once using a pool of threads.
+    :param app_syncs: list of ApplicationSync to synchronise
+    :param workers: Number of applications synchronised at the same time, PSYNC_SYNC_WORKERS if None
+    :param per_key: Maximum number of applications synchronised at the same time with one Podio key,
+                    PSYNC_SYNC_PER_KEY if None
+    :param timeout: Number of seconds after which an application sync is stopped, PSYNC_SYNC_TIMEOUT if None
+    :param full_sync: (True/False). Passed to sync_application
+    :param reload: (True/False). Passed to run_sync
+    :return: list of dictionaries (application, result, items_updated, duration), in the order of app_syncs
+    """
+    if workers is None:
+        workers = int(getattr(settings, 'PSYNC_SYNC_WORKERS', 4))
+    if per_key is None:
+        per_key = int(getattr(settings, 'PSYNC_SYNC_PER_KEY', 2))
+    if timeout is None:
+        timeout = getattr(settings, 'PSYNC_SYNC_TIMEOUT', None)
+    key_semaphores = dict((app_sync.podio_key_id, threading.BoundedSemaphore(per_key)) for app_sync in app_syncs)
+
+    def run(app_sync):
+        with key_semaphores[app_sync.podio_key_id]:
+            return run_sync(app_sync, full_sync=full_sync, timeout=timeout, reload=reload)
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        summaries = pool.map(run, interleave_by_key(list(app_syncs)))
+    finally:
+        pool.close()
+        pool.join()
+    order = dict((app_sync.pk, i) for i, app_sync in enumerate(app_syncs))
+    return sorted(summaries, key=lambda summary: order[summary['application'].pk])
@@ -0,0 +1,133 @@
+import datetime
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+import pytz
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+from podiosync.leases import lease_available
+from podiosync.models import ApplicationSync
+from podiosync.runner import run_sync
+
+logger = logging.getLogger(__name__)
+
+
+def get_interval_bounds():
+    """
+    :return: tuple (shortest, longest) interval between two syncs of an application, in seconds
+    """
+    min_interval = int(getattr(settings, 'PSYNC_SCHEDULE_MIN_INTERVAL', 300))
+    max_interval = int(getattr(settings, 'PSYNC_SCHEDULE_MAX_INTERVAL', 86400))
+    return min_interval, max(min_interval, max_interval)
+
+
+def next_interval(interval, summary):
+    """
+    Interval before the next sync of an application, from the result of its last sync.
+    The interval is halved when items were updated and increased by half when none were, so applications that
+    change often are synchronised often and idle ones are left alone.
+    :param interval: current interval in seconds, None for an application never scheduled
+    :param summary: dictionary returned by run_sync
+    :return: interval in seconds
+    """
+    min_interval, max_interval = get_interval_bounds()
+    if interval is None:
+        interval = min_interval
+    if summary['result'] != 'success':
+        # podio or the DB may be unavailable for a while, we try again later
+        interval *= 2
+    elif summary['items_updated']:
+        interval //= 2
+    else:
+        interval = interval * 3 // 2
+    return max(min_interval, min(max_interval, interval))
+
+
+def get_due_applications(now, exclude=()):
+    """
+    :param now: aware datetime
+    :param exclude: primary keys of the applications not to return (e.g. being synchronised)
+    :return: list of the enabled applications to synchronise, the most overdue first. Applications leased by a
+             worker are left out
+    """
+    app_syncs = (ApplicationSync.objects.filter(application_enabled=True)
+                 .filter(Q(next_sync__isnull=True) | Q(next_sync__lte=now))
+                 .filter(lease_available(now))
+                 .exclude(pk__in=list(exclude))
+                 .select_related('podio_key__podio_user'))
+    # applications never scheduled come first (databases do not agree on where NULL goes)
+    return sorted(app_syncs, key=lambda app_sync: (app_sync.next_sync is not None, app_sync.next_sync,
+                                                   app_sync.application_name))
+
+
+def run_scheduler(workers=None, per_key=None, timeout=None, tick=None, stop=None, on_sync=None):
+    """
+    Synchronise every enabled application when it is due, until stop is set.
+    No more than `workers` applications, and `per_key` applications per Podio key, are synchronised at once.
+    After each sync, the next one is scheduled using next_interval.
+    :param workers: Number of applications synchronised at the same time, PSYNC_SYNC_WORKERS if None
+    :param per_key: Maximum number of applications synchronised at the same time with one Podio key,
+                    PSYNC_SYNC_PER_KEY if None
+    :param timeout: Number of seconds after which an application sync is stopped, PSYNC_SYNC_TIMEOUT if None
+    :param tick: Number of seconds between two looks for due applications, PSYNC_SCHEDULE_TICK if None
+    :param stop: threading.Event, runs forever if None
+    :param on_sync: function called with the summary of every sync (see run_sync) and the next interval
+    """
+    if workers is None:
+        workers = int(getattr(settings, 'PSYNC_SYNC_WORKERS', 4))
+    if per_key is None:
+        per_key = int(getattr(settings, 'PSYNC_SYNC_PER_KEY', 2))
+    if timeout is None:
+        timeout = getattr(settings, 'PSYNC_SYNC_TIMEOUT', None)
+    if tick is None:
+        tick = int(getattr(settings, 'PSYNC_SCHEDULE_TICK', 5))
+    if stop is None:
+        stop = threading.Event()
+    workers = max(1, workers)
+    lock = threading.Lock()
+    # primary key of the applications being synchronised: Podio key ID
+    running = {}
+
+    def run(app_sync):
+        summary = run_sync(app_sync, timeout=timeout)
+        if summary['result'] == 'busy':
+            # synchronised by another worker, which schedules the next sync when it is done
+            interval = app_sync.sync_interval or get_interval_bounds()[0]
+        else:
+            interval = next_interval(app_sync.sync_interval, summary)
+        next_sync = pytz.utc.localize(datetime.datetime.utcnow()) + datetime.timedelta(seconds=interval)
+        try:
+            ApplicationSync.objects.filter(pk=app_sync.pk).update(sync_interval=interval, next_sync=next_sync)
+            if on_sync:
+                on_sync(summary, interval)
+        except Exception as e:
+            logger.error(str(e))
+        finally:
+            connections.close_all()
+            with lock:
+                del running[app_sync.pk]
+        return summary
+
+    pool = ThreadPool(workers)
+    try:
+        while not stop.is_set():
+            with lock:
+                busy = dict(running)
+            if len(busy) < workers:
+                now = pytz.utc.localize(datetime.datetime.utcnow())
+                for app_sync in get_due_applications(now, exclude=busy):
+                    if len(busy) >= workers:
+                        break
+                    if list(busy.values()).count(app_sync.podio_key_id) >= per_key:
+                        continue
+                    busy[app_sync.pk] = app_sync.podio_key_id
+                    with lock:
+                        running[app_sync.pk] = app_sync.podio_key_id
+                    pool.apply_async(run, (app_sync,))
+            stop.wait(tick)
+    finally:
+        pool.close()
+        pool.join()
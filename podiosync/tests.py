@@ -1,3 +1,865 @@
-from django.test import TestCase
+import datetime
+import json
+import pickle
+import time
 
-# Create your tests here.
+import pytz
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from podiosync import api, jobs, leases, reconcile, reload, utils, webhooks
+from podiosync.converters import RowConverter, parse_podio_datetime
+from podiosync.leases import ApplicationLease, LeaseUnavailable, claim_lease, renew_lease
+from podiosync.models import ApplicationSync, DeadLetterItem, PodioKey, PodioUser, SyncJob, WebhookEvent
+from podiosync.registry import generated_models
+from podiosync.scheduler import next_interval
+from podiosync.writer import write_rows
+from pypodio2.transport import HttpTransport, OAuthAuthorization, OAuthToken, TransportException
+
+
+def make_field(external_id, field_type, status='active', settings=None):
+    return {'external_id': external_id, 'type': field_type, 'status': status, 'label': external_id.title(),
+            'config': {'required': False, 'settings': settings or {}}}
+
+
+FIELDS = [make_field('title', 'text', settings={'size': 'small'}),
+          make_field('amount', 'number'),
+          make_field('status', 'category'),
+          make_field('emails', 'email'),
+          make_field('price', 'money'),
+          make_field('owner', 'contact'),
+          make_field('project', 'app'),
+          make_field('picture', 'image'),
+          make_field('place', 'location'),
+          make_field('due', 'date'),
+          make_field('old', 'text', status='deleted')]
+
+
+def make_item(item_id, edited='2016-02-01 10:00:00', title=u'Caf\xe9'):
+    return {'item_id': item_id,
+            'current_revision': {'created_on': edited},
+            'fields': [
+                {'external_id': 'title', 'type': 'text', 'values': [{'value': title}]},
+                {'external_id': 'amount', 'type': 'number', 'values': [{'value': '12.5000'}]},
+                {'external_id': 'status', 'type': 'category',
+                 'values': [{'value': {'text': 'Open'}}, {'value': {'text': 'Late'}}]},
+                {'external_id': 'emails', 'type': 'email',
+                 'values': [{'value': 'a@example.com'}, {'value': 'b@example.com'}]},
+                {'external_id': 'price', 'type': 'money', 'values': [{'value': '9.99', 'currency': 'EUR'}]},
+                {'external_id': 'owner', 'type': 'contact',
+                 'values': [{'value': {'name': 'Ann', 'profile_id': 1}}, {'value': {'name': 'Bob', 'profile_id': 2}}]},
+                {'external_id': 'project', 'type': 'app',
+                 'values': [{'value': {'title': 'Alpha', 'item_id': 7}}, {'value': {'title': 'Beta', 'item_id': 8}}]},
+                {'external_id': 'picture', 'type': 'image', 'values': [{'value': {'link': 'https://x/1.png'}}]},
+                {'external_id': 'place', 'type': 'location', 'values': [{'formatted': 'Paris, France'}]},
+                {'external_id': 'due', 'type': 'date',
+                 'values': [{'start': '2016-03-01 08:00:00', 'end': '2016-03-02 18:00:00'}]},
+            ]}
+
+
+class WriteRowsTest(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(WriteRowsTest, cls).setUpClass()
+        cls.model = utils.create_model('writer_test', fields=utils.generate_fields(FIELDS), app_label='psync')
+        cls.converter = RowConverter(FIELDS)
+
+    def setUp(self):
+        self.assertTrue(utils.create_table(self.model))
+
+    def tearDown(self):
+        with connection.schema_editor() as editor:
+            editor.delete_model(self.model)
+
+    def write(self, items):
+        rows = [self.converter(item) for item in items]
+        return write_rows(self.model, self.converter.columns, rows, batch_size=2)
+
+    def test_insert_update_skip(self):
+        self.assertEqual(self.write([make_item(1), make_item(2), make_item(3)]), (3, 0, 0))
+        self.assertEqual(self.write([make_item(1), make_item(2, title=u'Tea'), make_item(4)]), (1, 1, 1))
+        self.assertEqual(self.model.objects.count(), 4)
+        self.assertEqual(self.model.objects.get(item_id=2).title, u'Tea')
+        self.assertEqual(self.model.objects.get(item_id=1).title, u'Caf\xe9')
+
+    def test_omitted_field_written_as_null(self):
+        self.write([make_item(1)])
+        item = make_item(1)
+        # podio leaves out the fields without value
+        item['fields'] = [field for field in item['fields'] if field['external_id'] != 'title']
+        self.assertEqual(self.write([item]), (0, 1, 0))
+        self.assertIsNone(self.model.objects.get(item_id=1).title)
+
+    def test_unchanged_row_keeps_edit_date(self):
+        self.write([make_item(1)])
+        self.assertEqual(self.write([make_item(1, edited='2016-02-09 10:00:00')]), (0, 0, 1))
+        self.assertEqual(self.model.objects.get(item_id=1).date_edited,
+                         datetime.datetime(2016, 2, 9, 10, tzinfo=pytz.utc))
+
+    def test_failed_rows(self):
+        failed = []
+        rows = [self.converter(make_item(1)), self.converter(make_item(2))]
+        rows[1] = rows[1][:2] + ('not a date',) + rows[1][3:]
+        result = write_rows(self.model, self.converter.columns, rows,
+                            on_error=lambda row, e: failed.append(row[0]))
+        self.assertEqual(result, (1, 0, 0))
+        self.assertEqual(failed, [2])
+
+    def test_duplicate_item_in_batch(self):
+        self.assertEqual(self.write([make_item(1), make_item(1, title=u'Tea')]), (1, 0, 0))
+        self.assertEqual(self.model.objects.get(item_id=1).title, u'Caf\xe9')
+        self.assertEqual(self.model.objects.get(item_id=1).due, datetime.datetime(2016, 3, 1, 8, tzinfo=pytz.utc))
+
+
+class Response(dict):
+
+    def __init__(self, status, headers=None):
+        super(Response, self).__init__(headers or {})
+        self.status = status
+
+
+class ScriptedPool(object):
+    """
+    Connection pool answering the requests with the given (status, headers, body) in turn
+    """
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        self.requests.append((method, uri, body))
+        status, headers, data = self.answers.pop(0)
+        return Response(status, headers), data
+
+
+def make_token(access_token, expires_in=28800):
+    return {'access_token': access_token, 'refresh_token': 'refresh-%s' % access_token, 'expires_in': expires_in}
+
+
+class OAuthAuthorizationTest(TestCase):
+
+    def authorization(self, token, *answers, **kwargs):
+        self.pool = ScriptedPool(*answers)
+        return OAuthAuthorization('user', 'password', 'id', 'secret', 'https://api.podio.com', pool=self.pool,
+                                  token=token, **kwargs)
+
+    def test_valid_token_reused(self):
+        authorization = self.authorization(OAuthToken(make_token('a')))
+        self.assertEqual(authorization(), {'authorization': 'OAuth2 a'})
+        self.assertEqual(self.pool.requests, [])
+
+    def test_login_without_token(self):
+        authorization = self.authorization(None, (200, {}, json.dumps(make_token('a'))))
+        self.assertEqual(authorization(), {'authorization': 'OAuth2 a'})
+        self.assertIn('grant_type=password', self.pool.requests[0][2])
+
+    def test_token_refreshed_before_expiry(self):
+        refreshed = []
+        authorization = self.authorization(OAuthToken(make_token('a', expires_in=60)),
+                                           (200, {}, json.dumps(make_token('b'))),
+                                           refresh_margin=300, on_refresh=refreshed.append)
+        self.assertEqual(authorization(), {'authorization': 'OAuth2 b'})
+        self.assertIn('grant_type=refresh_token', self.pool.requests[0][2])
+        self.assertIn('refresh_token=refresh-a', self.pool.requests[0][2])
+        self.assertEqual([token.access_token for token in refreshed], ['b'])
+        # the new token is used until it expires
+        self.assertEqual(authorization(), {'authorization': 'OAuth2 b'})
+        self.assertEqual(len(self.pool.requests), 1)
+
+    def test_login_when_refresh_refused(self):
+        authorization = self.authorization(OAuthToken(make_token('a', expires_in=0)),
+                                           (400, {}, '{"error": "invalid_grant"}'),
+                                           (200, {}, json.dumps(make_token('b'))))
+        self.assertEqual(authorization(), {'authorization': 'OAuth2 b'})
+        self.assertIn('grant_type=password', self.pool.requests[1][2])
+
+
+class TokenCacheTest(TestCase):
+
+    def test_stored_token_reused_until_expired(self):
+        api.store_token('psync_token_test', OAuthToken(make_token('a')))
+        self.assertEqual(api.get_cached_token('psync_token_test').access_token, 'a')
+        api.store_token('psync_token_test', OAuthToken(make_token('b', expires_in=-1)))
+        self.assertIsNone(api.get_cached_token('psync_token_test'))
+
+
+class TransportRetryTest(TestCase):
+
+    def transport(self, *answers):
+        self.pool = ScriptedPool(*answers)
+        return HttpTransport('https://api.podio.com', lambda: {}, pool=self.pool, max_retries=2, backoff=0)
+
+    def test_read_retried_on_server_error(self):
+        transport = self.transport((503, {}, ''), (200, {}, '{"item_id": 1}'))
+        self.assertEqual(transport.GET(url='/item/1'), {'item_id': 1})
+        self.assertEqual(len(self.pool.requests), 2)
+
+    def test_write_not_retried_on_server_error(self):
+        transport = self.transport((503, {}, ''))
+        self.assertRaises(TransportException, transport.POST, url='/item/app/3/', title='x')
+        self.assertEqual(len(self.pool.requests), 1)
+
+    def test_rate_limited_write_retried(self):
+        transport = self.transport((429, {'retry-after': '0'}, ''), (200, {}, '{}'))
+        self.assertEqual(transport.POST(url='/item/app/3/', title='x'), {})
+        self.assertEqual(len(self.pool.requests), 2)
+
+    def test_give_up_after_max_retries(self):
+        transport = self.transport(*[(502, {}, '')] * 3)
+        self.assertRaises(TransportException, transport.GET, url='/item/1')
+        self.assertEqual(len(self.pool.requests), 3)
+
+    def test_client_error_not_retried(self):
+        transport = self.transport((404, {}, '{"error": "not_found"}'))
+        self.assertRaises(TransportException, transport.GET, url='/item/1')
+        self.assertEqual(len(self.pool.requests), 1)
+
+
+class RequestBuilderTest(TestCase):
+
+    def setUp(self):
+        self.pool = ScriptedPool(*[(200, {}, '{}')] * 3)
+        self.transport = HttpTransport('https://api.podio.com', lambda: {}, pool=self.pool)
+
+    def test_url(self):
+        self.transport.GET.item[12]()
+        self.transport.GET.item[12].revision(limit=5)
+        self.transport.DELETE.item[12]()
+        self.assertEqual(self.pool.requests, [('GET', 'https://api.podio.com/item/12', None),
+                                              ('GET', 'https://api.podio.com/item/12/revision?limit=5', None),
+                                              ('DELETE', 'https://api.podio.com/item/12', None)])
+
+    def test_builders_are_independent(self):
+        item = self.transport.GET.item
+        item[1]()
+        item[2]()
+        self.transport.POST.item.app[3]()
+        self.assertEqual([request[:2] for request in self.pool.requests],
+                         [('GET', 'https://api.podio.com/item/1'),
+                          ('GET', 'https://api.podio.com/item/2'),
+                          ('POST', 'https://api.podio.com/item/app/3')])
+
+    def test_explicit_url_and_post_body(self):
+        self.transport.POST(url='/item/app/3/filter/', limit=10, GET={'fields': 'items.view(micro)'})
+        method, uri, body = self.pool.requests[0]
+        self.assertEqual(uri, 'https://api.podio.com/item/app/3/filter/?fields=items.view%28micro%29')
+        self.assertIn('"limit": 10', body)
+
+
+class RowConverterTest(TestCase):
+
+    def setUp(self):
+        self.converter = RowConverter(FIELDS)
+
+    def test_columns(self):
+        self.assertEqual(self.converter.columns,
+                         ['item_id', 'date_updated', 'date_edited', 'title', 'amount', 'status', 'emails', 'price',
+                          'price_currency', 'owner', 'project', 'project_ref', 'picture', 'place', 'due', 'due_end',
+                          'row_hash'])
+
+    def test_values(self):
+        # the values get_value_for_field returned for each column
+        date_updated = datetime.datetime(2016, 4, 1, tzinfo=pytz.utc)
+        row = dict(zip(self.converter.columns, self.converter(make_item(42), date_updated)))
+        self.assertEqual(row['item_id'], 42)
+        self.assertEqual(row['date_updated'], date_updated)
+        self.assertEqual(row['date_edited'], datetime.datetime(2016, 2, 1, 10, tzinfo=pytz.utc))
+        self.assertEqual(row['title'], u'Caf\xe9')
+        self.assertEqual(row['amount'], u'12.5000')
+        self.assertEqual(row['status'], u'Open, Late')
+        self.assertEqual(row['emails'], u'a@example.com, b@example.com')
+        self.assertEqual(row['price'], u'9.99')
+        self.assertEqual(row['price_currency'], u'EUR')
+        self.assertEqual(row['owner'], u'Ann, Bob')
+        self.assertEqual(row['project'], u'Alpha, Beta')
+        self.assertEqual(row['project_ref'], u'7, 8')
+        self.assertEqual(row['picture'], 'https://x/1.png')
+        self.assertEqual(row['place'], 'Paris, France')
+        self.assertEqual(row['due'], datetime.datetime(2016, 3, 1, 8, tzinfo=pytz.utc))
+        self.assertEqual(row['due_end'], datetime.datetime(2016, 3, 2, 18, tzinfo=pytz.utc))
+
+    def test_missing_and_invalid_values(self):
+        item = make_item(42)
+        item['fields'] = [{'external_id': 'due', 'type': 'date', 'values': [{'start': '2016-03-01 08:00:00'}]},
+                          {'external_id': 'price', 'type': 'money', 'values': [{}]}]
+        row = dict(zip(self.converter.columns, self.converter(item)))
+        self.assertIsNone(row['title'])
+        self.assertIsNone(row['due_end'])
+        self.assertEqual(row['price'], u'')
+
+    def test_row_hash(self):
+        first = self.converter(make_item(42), datetime.datetime(2016, 4, 1, tzinfo=pytz.utc))
+        # neither the date of the sync nor the edit date change the hash, the values do
+        same = self.converter(make_item(42, edited='2016-02-05 10:00:00'),
+                              datetime.datetime(2016, 4, 2, tzinfo=pytz.utc))
+        changed = self.converter(make_item(42, title=u'Tea'))
+        self.assertEqual(first[-1], same[-1])
+        self.assertNotEqual(first[-1], changed[-1])
+
+    def test_pickle(self):
+        # the converter is sent to the transform processes
+        converter = pickle.loads(pickle.dumps(self.converter))
+        date_updated = datetime.datetime(2016, 4, 1, tzinfo=pytz.utc)
+        self.assertEqual(converter(make_item(42), date_updated), self.converter(make_item(42), date_updated))
+
+    def test_parse_podio_datetime(self):
+        self.assertEqual(parse_podio_datetime('2016-03-01 08:00:00'), datetime.datetime(2016, 3, 1, 8, tzinfo=pytz.utc))
+        self.assertEqual(parse_podio_datetime('2016-03-01T08:00:00'), datetime.datetime(2016, 3, 1, 8, tzinfo=pytz.utc))
+
+
+class StubArea(object):
+
+    def __init__(self, podio, name):
+        self.podio = podio
+        self.name = name
+
+    def find(self, object_id, **kwargs):
+        if self.name == 'Application':
+            return self.podio.app
+        self.podio.found.append(object_id)
+        for item in self.podio.items:
+            if item['item_id'] == object_id:
+                return item
+        raise TransportException(Response(404), '{"error": "not_found"}')
+
+    def filter(self, app_id, attributes, **kwargs):
+        podio = self.podio
+        podio.requests.append(attributes)
+        if podio.fail_after is not None and len(podio.requests) > podio.fail_after:
+            raise TransportException(Response(503), 'podio is down')
+        if attributes.get('sort_by') == 'created_on':
+            items = sorted(podio.items, key=lambda item: item['item_id'], reverse=bool(attributes.get('sort_desc')))
+        else:
+            items = sorted(podio.items, key=lambda item: item['current_revision']['created_on'],
+                           reverse=bool(attributes.get('sort_desc')))
+        filters = attributes.get('filters', {})
+        edited = filters.get('last_edit_on', {})
+        if 'from' in edited:
+            items = [item for item in items if item['current_revision']['created_on'] >= edited['from']]
+        if 'to' in edited:
+            items = [item for item in items if item['current_revision']['created_on'] <= edited['to']]
+        if 'item_id' in filters:
+            items = [item for item in items if item['item_id'] in filters['item_id']]
+        offset = attributes.get('offset', 0)
+        result = {'items': items[offset:offset + attributes['limit']], 'filtered': len(items)}
+        # changes made in podio once the nth request is answered
+        change = podio.changes.get(len(podio.requests))
+        if change:
+            change()
+        return result
+
+
+class StubPodio(object):
+    """
+    Podio client answering from a list of items, in place of PodioApi
+    """
+    app = None
+    items = []
+    requests = []
+    found = []
+    changes = {}
+    fail_after = None
+
+    def __init__(self, username):
+        self.auth = self
+
+    def __getattr__(self, name):
+        return StubArea(self, name)
+
+
+class StubPodioTestCase(TransactionTestCase):
+    """
+    Application synchronised from StubPodio, which replaces PodioApi in the modules listed
+    """
+    app_id = 9002
+    modules = (utils,)
+
+    def setUp(self):
+        user = PodioUser.objects.create(user_name='stub')
+        key = PodioKey.objects.create(key_nickname='key', podio_user=user, client_id='id', client_secret='secret')
+        self.app_sync = ApplicationSync.objects.create(application_id=self.app_id, application_name='Stub App',
+                                                       podio_key=key, application_enabled=True)
+        StubPodio.app = {'config': {'name': 'Stub App'}, 'fields': FIELDS}
+        StubPodio.items = []
+        StubPodio.requests = []
+        StubPodio.found = []
+        StubPodio.changes = {}
+        StubPodio.fail_after = None
+        self.podio_apis = [(module, module.PodioApi) for module in self.modules]
+        for module, podio_api in self.podio_apis:
+            module.PodioApi = StubPodio
+
+    def tearDown(self):
+        for module, podio_api in self.podio_apis:
+            module.PodioApi = podio_api
+        model = StubPodio.app and generated_models.get(self.app_id, utils.get_schema_hash(StubPodio.app))
+        if model is not None:
+            with connection.schema_editor() as editor:
+                editor.delete_model(model)
+        generated_models.discard(self.app_id)
+
+    def write_local(self, items):
+        """
+        Write items to the table of the application, as a previous sync did
+        """
+        model = utils.get_model_for_application(self.app_id, StubPodio.app)
+        converter = RowConverter(FIELDS)
+        write_rows(model, converter.columns, [converter(item) for item in items])
+        return model
+
+
+class ReconcileTest(StubPodioTestCase):
+    modules = (utils, reconcile)
+
+    def local_ids(self, model):
+        return set(model.objects.values_list('item_id', flat=True))
+
+    def test_deleted_items_removed(self):
+        StubPodio.items = [make_item(i) for i in range(1, 6)]
+        model = self.write_local([make_item(i) for i in range(1, 8)])
+        msg = reconcile.reconcile_application(self.app_id, 'stub')
+        self.assertEqual(msg, {'result': 'success', 'items_deleted': 2})
+        self.assertEqual(self.local_ids(model), set(range(1, 6)))
+        self.assertEqual(StubPodio.requests[0]['sort_by'], 'created_on')
+
+    def test_listing_restarted_when_items_created_meanwhile(self):
+        StubPodio.items = [make_item(i) for i in range(1, 601)]
+        model = self.write_local([make_item(i) for i in range(1, 602)])
+        # an item is created once the first page is listed
+        StubPodio.changes = {1: lambda: StubPodio.items.append(make_item(700))}
+        msg = reconcile.reconcile_application(self.app_id, 'stub')
+        self.assertEqual(msg, {'result': 'success', 'items_deleted': 1})
+        # two pages listed twice, then the item not listed is requested again
+        self.assertEqual(len(StubPodio.requests), 5)
+        self.assertEqual(self.local_ids(model), set(range(1, 601)))
+
+    def test_item_shifted_between_pages_kept(self):
+        StubPodio.items = [make_item(i) for i in range(1, 601)]
+        model = self.write_local([make_item(i) for i in range(1, 602)])
+        # an item is deleted and another one created once the first page is listed: the total is the same but
+        # item 501 moves to the first page and is never listed
+        StubPodio.changes = {1: lambda: StubPodio.items.__setitem__(slice(9, 10), []) or
+                             StubPodio.items.append(make_item(700))}
+        msg = reconcile.reconcile_application(self.app_id, 'stub')
+        self.assertEqual(msg, {'result': 'success', 'items_deleted': 1})
+        # the items not listed are requested again, only the ones podio does not find are deleted
+        self.assertEqual(StubPodio.requests[2]['filters'], {'item_id': [501, 601]})
+        self.assertEqual(StubPodio.found, [601])
+        self.assertEqual(self.local_ids(model), set(range(1, 601)))
+
+    def test_listing_cancelled_when_items_keep_changing(self):
+        StubPodio.items = [make_item(i) for i in range(1, 601)]
+        model = self.write_local([make_item(i) for i in range(1, 602)])
+        StubPodio.changes = dict((n, lambda: StubPodio.items.append(make_item(700 + len(StubPodio.items))))
+                                 for n in range(1, 10))
+        self.assertEqual(reconcile.reconcile_application(self.app_id, 'stub'), {'result': 'error'})
+        self.assertEqual(len(self.local_ids(model)), 601)
+
+
+class VerifyTest(StubPodioTestCase):
+    modules = (utils, reconcile)
+
+    def test_missing_item_fetched(self):
+        StubPodio.items = [make_item(i, edited='2016-02-0%s 10:00:00' % i) for i in range(1, 6)]
+        model = self.write_local(StubPodio.items[:2] + StubPodio.items[3:])
+        msg = reconcile.verify_application(self.app_id, 'stub')
+        self.assertEqual(msg, {'result': 'success', 'ranges_refetched': 1, 'items_updated': 1})
+        self.assertEqual(model.objects.count(), 5)
+        # only the items of the range missing an item are requested
+        self.assertEqual(StubPodio.requests[-1]['filters']['last_edit_on']['from'][:10], '2016-02-03')
+        self.app_sync.refresh_from_db()
+        self.assertIsNone(self.app_sync.last_synced)
+
+    def test_no_drift(self):
+        StubPodio.items = [make_item(i, edited='2016-02-0%s 10:00:00' % i) for i in range(1, 6)]
+        self.write_local(StubPodio.items)
+        msg = reconcile.verify_application(self.app_id, 'stub')
+        self.assertEqual(msg, {'result': 'success', 'ranges_refetched': 0, 'items_updated': 0})
+
+    def test_stale_item_fetched(self):
+        StubPodio.items = [make_item(i, edited='2016-02-0%s 10:00:00' % i) for i in range(1, 6)]
+        model = self.write_local(StubPodio.items)
+        # the row is counted at its old date in the table and at its new one in podio, the totals are the same
+        StubPodio.items[1] = make_item(2, edited='2016-02-20 10:00:00', title=u'Tea')
+        msg = reconcile.verify_application(self.app_id, 'stub')
+        self.assertEqual(msg, {'result': 'success', 'ranges_refetched': 2, 'items_updated': 1})
+        self.assertEqual(model.objects.get(item_id=2).title, u'Tea')
+
+
+class WebhookTest(StubPodioTestCase):
+
+    def post(self, application_id, **data):
+        return self.client.post(reverse('webhook', kwargs={'application_id': application_id}), data)
+
+    def test_event_queued(self):
+        self.assertEqual(self.post(self.app_id, type='item.update', item_id='12').status_code, 200)
+        self.assertEqual(list(WebhookEvent.objects.values_list('application', 'item_id', 'event_type')),
+                         [(self.app_sync.pk, 12, 'item.update')])
+
+    def test_unknown_application(self):
+        self.assertEqual(self.post(1234, type='item.update', item_id='12').status_code, 404)
+        self.app_sync.application_enabled = False
+        self.app_sync.save()
+        self.assertEqual(self.post(self.app_id, type='item.update', item_id='12').status_code, 404)
+
+    def test_application_under_two_keys(self):
+        key = PodioKey.objects.create(key_nickname='other', podio_user=self.app_sync.podio_key.podio_user,
+                                      client_id='other', client_secret='secret')
+        ApplicationSync.objects.create(application_id=self.app_id, application_name='Stub App', podio_key=key,
+                                       application_enabled=True)
+        self.assertEqual(self.post(self.app_id, type='item.update', item_id='12').status_code, 200)
+        self.assertEqual(list(WebhookEvent.objects.values_list('application', 'item_id')), [(self.app_sync.pk, 12)])
+
+    def test_invalid_item(self):
+        self.assertEqual(self.post(self.app_id, type='item.update', item_id='x').status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+class ApplyEventsTest(StubPodioTestCase):
+
+    def queue(self, *events):
+        for event_type, item_id in events:
+            WebhookEvent.objects.create(application=self.app_sync, item_id=item_id, event_type=event_type)
+
+    def test_events_coalesced(self):
+        StubPodio.items = [make_item(1), make_item(2, title=u'Tea')]
+        model = self.write_local([make_item(2), make_item(3)])
+        self.queue(('item.create', 1), ('item.update', 1), ('item.update', 2), ('item.update', 1),
+                   ('item.delete', 3))
+        summaries = webhooks.apply_events()
+        self.assertEqual([(summary['result'], summary['items_updated'], summary['items_deleted'])
+                          for summary in summaries], [('success', 2, 1)])
+        # every item is requested once whatever the number of its events, the ones the filter does not return
+        # are looked for on their own
+        self.assertEqual(StubPodio.requests[0]['filters'], {'item_id': [1, 2, 3]})
+        self.assertEqual(StubPodio.found, [3])
+        self.assertEqual(sorted(model.objects.values_list('item_id', 'title')), [(1, u'Caf\xe9'), (2, u'Tea')])
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_forged_delete_ignored(self):
+        StubPodio.items = [make_item(1)]
+        model = self.write_local([make_item(1)])
+        self.queue(('item.delete', 1))
+        webhooks.apply_events()
+        self.assertEqual(model.objects.count(), 1)
+
+    def test_events_kept_on_error(self):
+        # the application cannot be retrieved from podio
+        StubPodio.app = None
+        self.queue(('item.update', 1))
+        self.assertEqual(webhooks.apply_events()[0]['result'], 'error')
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_events_of_disabled_application_dropped(self):
+        self.app_sync.application_enabled = False
+        self.app_sync.save()
+        self.queue(('item.update', 1))
+        self.assertEqual(webhooks.apply_events()[0]['result'], 'disabled')
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+@override_settings(PSYNC_FETCH_WORKERS=1)
+class SyncJobTest(StubPodioTestCase):
+
+    def test_submit_returns_pending_job(self):
+        job = jobs.submit_job(self.app_sync)
+        self.assertEqual(jobs.submit_job(self.app_sync).pk, job.pk)
+        # a full sync is requested before the job starts
+        self.assertTrue(jobs.submit_job(self.app_sync, full_sync=True).full_sync)
+        self.assertEqual(SyncJob.objects.count(), 1)
+        jobs.claim_job()
+        self.assertEqual(jobs.submit_job(self.app_sync).pk, job.pk)
+        SyncJob.objects.filter(pk=job.pk).update(status='success')
+        self.assertNotEqual(jobs.submit_job(self.app_sync).pk, job.pk)
+
+    def test_claim_oldest_job(self):
+        other = ApplicationSync.objects.create(application_id=9003, application_name='Other',
+                                               podio_key=self.app_sync.podio_key, application_enabled=True)
+        first = jobs.submit_job(self.app_sync)
+        second = jobs.submit_job(other)
+        job = jobs.claim_job()
+        self.assertEqual((job.pk, job.status), (first.pk, 'running'))
+        self.assertIsNotNone(job.started)
+        self.assertEqual(jobs.claim_job().pk, second.pk)
+        self.assertIsNone(jobs.claim_job())
+
+    def test_stale_job_queued_again(self):
+        job = jobs.submit_job(self.app_sync)
+        jobs.claim_job()
+        self.assertIsNone(jobs.claim_job())
+        # the worker died more than a lease duration ago
+        SyncJob.objects.filter(pk=job.pk).update(started=leases.utc_now() - datetime.timedelta(hours=1))
+        claim_lease(self.app_sync.pk, 'b', 60)
+        self.assertIsNone(jobs.claim_job())
+        ApplicationSync.objects.filter(pk=self.app_sync.pk).update(lease_owner=None, lease_expires=None)
+        self.assertEqual(jobs.claim_job().pk, job.pk)
+        self.assertEqual(SyncJob.objects.get().status, 'running')
+
+    def test_run_job(self):
+        StubPodio.items = [make_item(i) for i in range(1, 4)]
+        jobs.submit_job(self.app_sync)
+        self.assertEqual(jobs.run_job(jobs.claim_job())['result'], 'success')
+        job = SyncJob.objects.get()
+        self.assertEqual((job.status, job.items_total, job.items_written), ('success', 3, 3))
+        self.assertIsNotNone(job.finished)
+
+
+@override_settings(PSYNC_SCHEDULE_MIN_INTERVAL=300, PSYNC_SCHEDULE_MAX_INTERVAL=3600)
+class NextIntervalTest(TestCase):
+
+    def test_first_sync(self):
+        self.assertEqual(next_interval(None, {'result': 'success', 'items_updated': 0}), 450)
+        self.assertEqual(next_interval(None, {'result': 'success', 'items_updated': 3}), 300)
+
+    def test_updated_items(self):
+        self.assertEqual(next_interval(1000, {'result': 'success', 'items_updated': 3}), 500)
+        self.assertEqual(next_interval(400, {'result': 'success', 'items_updated': 3}), 300)
+
+    def test_no_updated_item(self):
+        self.assertEqual(next_interval(1000, {'result': 'success', 'items_updated': 0}), 1500)
+        self.assertEqual(next_interval(3000, {'result': 'success', 'items_updated': 0}), 3600)
+
+    def test_error(self):
+        self.assertEqual(next_interval(1000, {'result': 'error', 'items_updated': 0}), 2000)
+        self.assertEqual(next_interval(3000, {'result': 'error', 'items_updated': 0}), 3600)
+
+
+class ApplicationLeaseTest(StubPodioTestCase):
+    modules = (utils, reconcile)
+
+    def lease_owner(self):
+        return ApplicationSync.objects.values_list('lease_owner', flat=True).get(pk=self.app_sync.pk)
+
+    def test_claim_and_release(self):
+        with ApplicationLease(self.app_sync, owner='a'):
+            self.assertEqual(self.lease_owner(), 'a')
+            self.assertRaises(LeaseUnavailable, ApplicationLease(self.app_sync, owner='b').__enter__)
+        self.assertIsNone(self.lease_owner())
+        self.assertTrue(claim_lease(self.app_sync.pk, 'b', 60))
+
+    def test_expired_lease_taken(self):
+        self.assertTrue(claim_lease(self.app_sync.pk, 'a', -1))
+        self.assertTrue(claim_lease(self.app_sync.pk, 'b', 60))
+        self.assertFalse(claim_lease(self.app_sync.pk, 'a', 60))
+        self.assertEqual(self.lease_owner(), 'b')
+
+    def test_renew(self):
+        self.assertTrue(claim_lease(self.app_sync.pk, 'a', 60))
+        self.assertTrue(renew_lease(self.app_sync.pk, 'a', 60))
+        self.assertFalse(renew_lease(self.app_sync.pk, 'b', 60))
+
+    def heartbeat(self, renewed, deadline=None):
+        """
+        Run a lease for 0.35 second, renew_lease answering renewed (the heartbeat thread has no access to the
+        in-memory test DB)
+        :return: the lease and the owners it was renewed for
+        """
+        renewals = []
+
+        def renew(app_pk, owner, duration):
+            renewals.append(owner)
+            return renewed
+        leases.renew_lease = renew
+        try:
+            with ApplicationLease(self.app_sync, duration=0.3, owner='a', deadline=deadline) as lease:
+                time.sleep(0.35)
+        finally:
+            leases.renew_lease = renew_lease
+        return lease, renewals
+
+    def test_lease_renewed(self):
+        lease, renewals = self.heartbeat(True)
+        # every third of the duration
+        self.assertGreaterEqual(len(renewals), 2)
+        self.assertEqual(set(renewals), set(['a']))
+        self.assertFalse(lease.lost.is_set())
+
+    def test_lease_lost(self):
+        lease, renewals = self.heartbeat(False)
+        self.assertEqual(renewals, ['a'])
+        self.assertTrue(lease.lost.is_set())
+
+    def test_lease_not_renewed_past_deadline(self):
+        lease, renewals = self.heartbeat(True, deadline=time.time())
+        self.assertEqual(renewals, [])
+        self.assertFalse(lease.lost.is_set())
+
+    def test_lost_lease_stops_writing(self):
+        StubPodio.items = [make_item(i) for i in range(1, 4)]
+        with ApplicationLease(self.app_sync) as lease:
+            lease.lost.set()
+            self.assertEqual(utils.sync_application(self.app_id, 'stub', lease=lease)['result'], 'error')
+            self.assertEqual(reconcile.reconcile_application(self.app_id, 'stub', lease=lease)['result'], 'error')
+        model = utils.get_model_for_application(self.app_id, StubPodio.app)
+        self.assertEqual(model.objects.count(), 0)
+        self.app_sync.refresh_from_db()
+        self.assertIsNone(self.app_sync.last_synced)
+
+    def test_busy_application_keeps_events(self):
+        WebhookEvent.objects.create(application=self.app_sync, item_id=1, event_type='item.update')
+        claim_lease(self.app_sync.pk, 'b', 60)
+        self.assertEqual(webhooks.apply_events()[0]['result'], 'busy')
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_job_of_leased_application_left_queued(self):
+        jobs.submit_job(self.app_sync)
+        claim_lease(self.app_sync.pk, 'b', 60)
+        self.assertIsNone(jobs.claim_job())
+        self.assertEqual(SyncJob.objects.get().status, 'queued')
+
+
+@override_settings(PSYNC_FETCH_WORKERS=1, PSYNC_BATCH_SIZE=100)
+class SyncCheckpointTest(StubPodioTestCase):
+
+    def setUp(self):
+        super(SyncCheckpointTest, self).setUp()
+        start = datetime.datetime(2016, 1, 1, tzinfo=pytz.utc)
+        StubPodio.items = [make_item(i, (start + datetime.timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'))
+                           for i in range(1, 651)]
+
+    def sync(self, **kwargs):
+        StubPodio.requests = []
+        return utils.sync_application(self.app_id, 'stub', **kwargs)
+
+    def test_incremental_sync_bounds(self):
+        self.assertEqual(self.sync()['items_updated'], 650)
+        self.assertNotIn('filters', StubPodio.requests[0])
+        self.app_sync.refresh_from_db()
+        last_synced = self.app_sync.last_synced
+        self.assertIsNone(self.app_sync.sync_run_id)
+        self.sync()
+        self.assertEqual(StubPodio.requests[0]['filters'],
+                         {'last_edit_on': {'from': last_synced.strftime('%Y-%m-%d %H:%M:%S')}})
+
+    def test_resume_from_checkpoint(self):
+        # the second page cannot be fetched: the first one is written and recorded as the checkpoint
+        StubPodio.fail_after = 1
+        self.assertEqual(self.sync()['result'], 'error')
+        self.app_sync.refresh_from_db()
+        self.assertIsNone(self.app_sync.last_synced)
+        self.assertIsNotNone(self.app_sync.sync_run_id)
+        # items 650 to 151 were on the first page, from the most recently edited
+        self.assertEqual(self.app_sync.sync_cursor, datetime.datetime(2016, 1, 1, 2, 31, tzinfo=pytz.utc))
+        sync_started = self.app_sync.sync_started
+
+        StubPodio.fail_after = None
+        msg = self.sync()
+        self.assertEqual(msg['result'], 'success')
+        # only the items not written yet are requested, the first written one again as it is the bound
+        self.assertEqual(StubPodio.requests[0]['filters'], {'last_edit_on': {'to': '2016-01-01 02:31:00'}})
+        self.assertEqual(msg['items_updated'], 150)
+        self.app_sync.refresh_from_db()
+        self.assertEqual(self.app_sync.last_synced, sync_started)
+        self.assertIsNone(self.app_sync.sync_run_id)
+        self.assertIsNone(self.app_sync.sync_cursor)
+
+    def test_full_sync_does_not_resume_incremental_sync(self):
+        StubPodio.fail_after = 1
+        self.sync()
+        sync_from = datetime.datetime(2016, 1, 1, tzinfo=pytz.utc)
+        ApplicationSync.objects.filter(pk=self.app_sync.pk).update(sync_from=sync_from)
+        StubPodio.fail_after = None
+        # an incremental sync cannot be resumed by a full one: it starts over
+        self.assertEqual(self.sync(full_sync=True)['result'], 'success')
+        self.assertNotIn('filters', StubPodio.requests[0])
+
+    def test_bad_item_dead_lettered(self):
+        StubPodio.items = [make_item(1), make_item(2, edited='not a date'), make_item(3)]
+        msg = self.sync()
+        self.assertEqual((msg['result'], msg['items_updated']), ('success', 2))
+        self.assertEqual(list(DeadLetterItem.objects.values_list('application', 'item_id')), [(self.app_sync.pk, 2)])
+
+
+class ReloadTest(StubPodioTestCase):
+    modules = (utils, reload)
+
+    def shadow_tables(self, model):
+        return [name for name in connection.introspection.table_names()
+                if name.startswith(model._meta.db_table + reload.SHADOW_MARK)]
+
+    def test_table_swapped(self):
+        StubPodio.items = [make_item(1), make_item(2, title=u'Tea'), make_item(3)]
+        model = self.write_local([make_item(2), make_item(4)])
+        msg = reload.reload_application(self.app_id, 'stub')
+        self.assertEqual(msg, {'result': 'success', 'items_updated': 3})
+        self.assertEqual(sorted(model.objects.values_list('item_id', 'title')),
+                         [(1, u'Caf\xe9'), (2, u'Tea'), (3, u'Caf\xe9')])
+        self.assertEqual(self.shadow_tables(model), [])
+        # the indexes were built on the new table
+        self.assertRaises(IntegrityError, model.objects.create, item_id=1)
+        # and named after it
+        table_name = model._meta.db_table
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table_name)
+        index_names = [name for name, constraint in constraints.items() if constraint['columns'] == ['item_id']]
+        self.assertTrue(index_names)
+        for name in index_names:
+            self.assertTrue(name.startswith(table_name + '_'))
+            self.assertNotIn(reload.SHADOW_MARK, name)
+        self.app_sync.refresh_from_db()
+        self.assertIsNotNone(self.app_sync.last_synced)
+
+    def test_failed_reload_leaves_table(self):
+        StubPodio.items = [make_item(1), make_item(2, title=u'Tea')]
+        StubPodio.fail_after = 0
+        model = self.write_local([make_item(2), make_item(4)])
+        self.assertEqual(reload.reload_application(self.app_id, 'stub'), {'result': 'error'})
+        self.assertEqual(sorted(model.objects.values_list('item_id', 'title')), [(2, u'Caf\xe9'), (4, u'Caf\xe9')])
+        self.assertEqual(self.shadow_tables(model), [])
+
+
+class TokenRejectedTest(TestCase):
+
+    def test_rejected_token_refreshed_and_request_retried(self):
+        rejected = []
+        pool = ScriptedPool((401, {}, '{"error": "invalid_token"}'),
+                            (200, {}, json.dumps(make_token('b'))),
+                            (200, {}, '{"item_id": 1}'))
+        authorization = OAuthAuthorization('user', 'password', 'id', 'secret', 'https://api.podio.com', pool=pool,
+                                           token=OAuthToken(make_token('a')), on_reject=rejected.append)
+        transport = HttpTransport('https://api.podio.com', authorization, pool=pool, authorization=authorization)
+        self.assertEqual(transport.GET.item[1](), {'item_id': 1})
+        self.assertEqual([token.access_token for token in rejected], ['a'])
+        self.assertIn('grant_type=refresh_token', pool.requests[1][2])
+        self.assertEqual(authorization(), {'authorization': 'OAuth2 b'})
+
+    def test_rejected_twice(self):
+        pool = ScriptedPool((401, {}, '{"error": "invalid_token"}'),
+                            (200, {}, json.dumps(make_token('b'))),
+                            (401, {}, '{"error": "invalid_token"}'))
+        authorization = OAuthAuthorization('user', 'password', 'id', 'secret', 'https://api.podio.com', pool=pool,
+                                           token=OAuthToken(make_token('a')))
+        transport = HttpTransport('https://api.podio.com', authorization, pool=pool, authorization=authorization)
+        self.assertRaises(TransportException, transport.GET.item[1])
+        self.assertEqual(len(pool.requests), 3)
+
+    def test_token_replaced_meanwhile(self):
+        pool = ScriptedPool()
+        authorization = OAuthAuthorization('user', 'password', 'id', 'secret', 'https://api.podio.com', pool=pool,
+                                           token=OAuthToken(make_token('b')))
+        # a request sent with the previous token is rejected after the token was refreshed
+        authorization.rejected({'authorization': 'OAuth2 a'})
+        self.assertEqual(pool.requests, [])
+
+    @override_settings(PSYNC_TOKEN_CACHE='default')
+    def test_shared_cache_first(self):
+        api.store_token('psync_token_test', OAuthToken(make_token('a')))
+        # another process refreshed the token
+        caches['default'].set('psync_token_test', api.encrypt_token(OAuthToken(make_token('b')).to_dict()))
+        self.assertEqual(api.get_cached_token('psync_token_test').access_token, 'b')
+        api.drop_token('psync_token_test', OAuthToken(make_token('a')))
+        self.assertEqual(api.get_cached_token('psync_token_test').access_token, 'b')
+        api.drop_token('psync_token_test', OAuthToken(make_token('b')))
+        self.assertIsNone(caches['default'].get('psync_token_test'))
+
+    @override_settings(PSYNC_TOKEN_CACHE='default')
+    def test_shared_cache_encrypted(self):
+        api.store_token('psync_token_test', OAuthToken(make_token('a')))
+        self.assertNotIn('refresh-a', caches['default'].get('psync_token_test'))
+        # a token stored in clear text by a previous version is ignored
+        caches['default'].set('psync_token_test', OAuthToken(make_token('b')).to_dict())
+        self.assertEqual(api.get_cached_token('psync_token_test').access_token, 'a')
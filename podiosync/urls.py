@@ -11,6 +11,8 @@ urlpatterns = [
     url(r'^sync/application/(?P<action_sync>[^/]+)/(?P<application_id>[^/]+)/$', podiosync_views.application_sync, name='application-sync'),
     url(r'^sync/list/$', podiosync_views.sync_list, name='sync-list'),
     url(r'^sync/run/$', podiosync_views.application_sync_data, name='sync-run'),
+    url(r'^sync/job/(?P<job_id>[0-9]+)/$', podiosync_views.sync_job, name='sync-job'),
+    url(r'^hooks/(?P<application_id>[0-9]+)/$', podiosync_views.webhook, name='webhook'),
     url(r'^history/$', podiosync_views.history, name='history'),
     url(r'^history/(?P<application_id>[^/]+)/$', podiosync_views.history, name='history-app'),
     url(r'^edit/settings/(?P<form_name>[^/]+)/$', podiosync_views.edit_settings, name='edit-settings'),
@@ -1,54 +1,288 @@
 import logging
+from django.apps import apps
 from django.conf import settings
 from django.contrib import admin
-from django.db import models, OperationalError, transaction, IntegrityError
+from django.db import models, OperationalError, IntegrityError
 from django.db import DEFAULT_DB_ALIAS, connections
 from django.utils.text import slugify
-from django.utils.encoding import smart_str
 
-from dateutil import parser
+from multiprocessing.pool import ThreadPool
 import datetime
+import functools
+import hashlib
+import json
 import pytz
+import time
+import uuid
 
 from podiosync.api import PodioApi
-from podiosync.models import ApplicationSync, PodioKey, SyncLog
+from podiosync.converters import RowConverter, parse_podio_datetime
+from podiosync.leases import LeaseLost
+from podiosync.models import ApplicationSync, DeadLetterItem, PodioKey, SyncLog
+from podiosync.pipeline import StageError, run_pipeline
+from podiosync.registry import generated_models, unregister_model
+from podiosync.writer import chunks, delete_rows, get_batch_size, write_rows
+from pypodio2.transport import TransportException
 
 logger = logging.getLogger(__name__)
 
 
-def sync_application(app_id, api_user):
+# to be increased whenever generate_fields changes the tables it generates
+SCHEMA_VERSION = 3
+
+
+class SyncTimeout(Exception):
+    pass
+
+
+def sync_application(app_id, api_user, full_sync=False, deadline=None, progress=None, lease=None):
     """
     Overall function that calls all different functions in order to update a table
     The table will be created if not existing and data will be added to the table
+    Unless full_sync is set, only the items edited since the last successful sync are requested from Podio.
+    Items are written from the most recently edited one, and a checkpoint is saved after each batch. If the previous
+    sync was interrupted, it is resumed from its checkpoint: only the items it did not write yet are requested.
     :param app_id: Podio application ID
     :param api_user: User to enable Podio API usage
-    :return: dictionary with message
+    :param full_sync: (True/False). If set to True, every item of the application is fetched and updated
+    :param deadline: timestamp (time.time()) after which no more page is fetched and the sync fails
+    :param progress: function called with keyword arguments as the sync goes, see get_application_items and
+                     update_table
+    :param lease: ApplicationLease held on the application, the sync stops if it is lost
+    :return: dictionary with message (and the number of items updated if successful)
     """
     msg = {'result': 'error'}
     podio_api = PodioApi(api_user)
     app_data = get_application(app_id, podio_api)
     if app_data:
-        model_fields = generate_fields(app_data['fields'])
-        if model_fields:
-            app_name = str(slugify(app_data['config']['name']).replace('-', '_'))
-            model_to_update = create_model(app_name, fields=model_fields, app_label=getattr(settings, 'PSYNC_TABLE_PREFIX', 'psync'))
-            if model_to_update:
-                if modify_table(model_to_update):
-                    # now we can update the data
-                    items = get_application_items(app_id, podio_api)
-                    if update_table(model_to_update, app_id, items):
-                        msg['result'] = 'success'
-                    else:
-                        log_info(app_id, 'ERROR', 'SYSTEM', 'Could not update table')
-                else:
-                    log_info(app_id, 'ERROR', 'SQL', 'Could not modify table')
-        else:
-            log_info(app_id, 'ERROR', 'SYSTEM', 'Could not generate fields')
+        model_to_update = get_model_for_application(app_id, app_data, check_table=full_sync)
+        if model_to_update:
+            # now we can update the data
+            app_syncs = ApplicationSync.objects.filter(application_id=app_id)
+            app_sync = app_syncs.first()
+            if app_sync and app_sync.sync_run_id and (not full_sync or app_sync.sync_from is None):
+                # the previous sync was interrupted (a full sync can resume an incremental one but not the reverse)
+                run_id = app_sync.sync_run_id
+                sync_started = app_sync.sync_started
+                last_edit_from = app_sync.sync_from
+                full_sync = last_edit_from is None
+                cursor = app_sync.sync_cursor
+                logger.info('Resuming sync %s of application %s from %s' % (run_id, app_id, cursor))
+            else:
+                run_id = uuid.uuid4().hex
+                # items edited while we are syncing will be picked up by the next run
+                sync_started = pytz.utc.localize(datetime.datetime.utcnow())
+                last_edit_from = None if full_sync or not app_sync else app_sync.last_synced
+                cursor = None
+                app_syncs.update(sync_run_id=run_id, sync_started=sync_started, sync_from=last_edit_from,
+                                 sync_cursor=None)
+            items = get_application_items(app_id, podio_api, last_edit_from=last_edit_from, last_edit_to=cursor,
+                                          deadline=deadline, progress=progress, lease=lease)
+            result = update_table(model_to_update, app_id, items, RowConverter(app_data['fields']),
+                                  full_sync=full_sync, synced_at=sync_started, progress=progress,
+                                  checkpoint=lambda date_edited: app_syncs.update(sync_cursor=date_edited),
+                                  run_id=run_id, lease=lease)
+            if result:
+                msg['result'] = 'success'
+                msg['items_updated'] = result['items_updated']
+            else:
+                log_info(app_id, 'ERROR', 'SYSTEM', 'Could not update table')
     else:
         log_info(app_id, 'ERROR', 'PODIO', 'Could not retrieve Application from podio')
     return msg
 
 
+def refresh_items(app_id, api_user, item_ids, database=None, delete_missing=False, lease=None):
+    """
+    Retrieve the given items from podio and update them in the table of the application.
+    Items are requested in batches (see get_items_by_id) and last_synced is left as is.
+    :param app_id: Podio application ID
+    :param api_user: User to enable Podio API usage
+    :param item_ids: Podio item IDs
+    :param database: The name of the database to use
+    :param delete_missing: (True/False). If set to True, the items not found in podio are deleted from the table
+    :param lease: ApplicationLease held on the application, the update stops if it is lost
+    :return: dictionary with message (and the number of items updated and deleted if successful)
+    """
+    msg = {'result': 'error'}
+    podio_api = PodioApi(api_user)
+    app_data = get_application(app_id, podio_api)
+    if not app_data:
+        return msg
+    model_class = get_model_for_application(app_id, app_data)
+    if not model_class:
+        return msg
+    item_ids = set(int(item_id) for item_id in item_ids)
+    converter = RowConverter(app_data['fields'])
+    found_ids = set()
+
+    def pages():
+        for page in get_items_by_id(app_id, podio_api, item_ids):
+            found_ids.update(item['item_id'] for item in page)
+            yield page
+
+    result = update_table(model_class, app_id, pages(), converter, database=database, full_sync=True,
+                          record_sync=False, lease=lease)
+    if result is None:
+        return msg
+    items_updated = result['items_updated']
+
+    # items not returned by the filter were deleted, or are not in this application (or podio refused the filter).
+    # Asking for each of them tells which ones
+    try:
+        items, missing_ids = find_items(app_id, podio_api, item_ids - found_ids)
+    except TransportException as e:
+        logger.error(str(e))
+        log_info(app_id, 'ERROR', 'PODIO', 'Could not retrieve items from podio: %s' % e)
+        return msg
+    if items:
+        result = update_table(model_class, app_id, [items], converter, database=database, full_sync=True,
+                              record_sync=False, lease=lease)
+        if result is None:
+            return msg
+        items_updated += result['items_updated']
+
+    msg['result'] = 'success'
+    msg['items_updated'] = items_updated
+    msg['items_missing'] = len(missing_ids)
+    msg['items_deleted'] = 0
+    if delete_missing and missing_ids:
+        if lease:
+            try:
+                lease.check()
+            except LeaseLost as e:
+                logger.error(str(e))
+                msg['result'] = 'error'
+                return msg
+        msg['items_deleted'] = delete_rows(model_class, missing_ids, database=database)
+        message = '%s deleted items removed from table: %s' % (msg['items_deleted'], model_class._meta.db_table)
+        logger.info(message)
+        log_info(app_id, 'SUCCESS', 'SQL', message, items_written=msg['items_deleted'])
+    return msg
+
+
+def find_items(app_id, api_object, item_ids):
+    """
+    Request the given items one by one, to tell the items of an application from the ones that were deleted
+    (or are not in this application).
+    :param app_id: Podio application ID
+    :param api_object: PodioApi object
+    :param item_ids: Podio item IDs
+    :return: tuple (list of the items of the application, list of the IDs of the other items)
+    :raises TransportException: if podio fails otherwise than not finding an item
+    """
+    items = []
+    missing_ids = []
+    for item_id in sorted(item_ids):
+        try:
+            item = api_object.auth.Item.find(item_id)
+        except TransportException as e:
+            if getattr(e.status, 'status', None) in (404, 410):
+                missing_ids.append(item_id)
+                continue
+            raise
+        if item.get('app', {}).get('app_id', int(app_id)) == int(app_id):
+            items.append(item)
+        else:
+            missing_ids.append(item_id)
+    return items, missing_ids
+
+
+def get_items_by_id(app_id, api_object, item_ids, batch_size=None):
+    """
+    Generator retrieving the given items of an application, filtering the application on a batch of item IDs
+    per request rather than requesting each item on its own.
+    Items that do not exist (anymore) are not returned. If Podio refuses the filter (400), no more batch is
+    requested and the items left are not returned either: the caller finds them one by one (see refresh_items).
+    Other errors from Podio are raised to the caller.
+    :param app_id: Podio application ID
+    :param api_object: PodioApi object
+    :param item_ids: Podio item IDs
+    :param batch_size: Number of items per request, PSYNC_REFRESH_BATCH_SIZE if None (500 at most)
+    :return: generator of lists of items
+    """
+    if not batch_size:
+        batch_size = int(getattr(settings, 'PSYNC_REFRESH_BATCH_SIZE', 100))
+    for batch in chunks(sorted(set(int(item_id) for item_id in item_ids)), min(batch_size, 500)):
+        try:
+            result = api_object.auth.Item.filter(int(app_id), {'limit': len(batch),
+                                                               'filters': {'item_id': batch}})['items']
+        except TransportException as e:
+            if getattr(e.status, 'status', None) != 400:
+                raise
+            logger.error('Items of application %s cannot be filtered by ID, requesting them one by one: %s' %
+                         (app_id, e))
+            return
+        if result:
+            yield result
+
+
+def get_schema_hash(app_data):
+    """
+    Fingerprint of everything the table of an application is built from (name and fields definition).
+    :param app_data: application as returned by podio
+    :return: hexadecimal string
+    """
+    fields = []
+    for field in app_data['fields']:
+        fields.append([field['external_id'], field['type'], field['status'], field['label'],
+                       (field['config'].get('settings') or {}).get('size')])
+    schema = [SCHEMA_VERSION,
+              getattr(settings, 'PSYNC_TABLE_PREFIX', 'psync'),
+              getattr(settings, 'PSYNC_INDEX_DATE_UPDATED', False),
+              app_data['config']['name'],
+              fields]
+    return hashlib.sha1(json.dumps(schema, sort_keys=True)).hexdigest()
+
+
+def get_model_for_application(app_id, app_data, check_table=False):
+    """
+    Return the model of the application table, creating or altering the table if the application changed.
+    When the fields of the application are the same as on the last successful run, the table is not checked.
+    :param app_id: Podio application ID
+    :param app_data: application as returned by podio
+    :param check_table: (True/False). If set to True, the table is checked even if the application did not change
+    :return: the model or None if an error occurred
+    """
+    schema_hash = get_schema_hash(app_data)
+    model_to_update = generated_models.get_or_create(int(app_id), schema_hash,
+                                                     lambda: build_model(app_id, app_data))
+    if not model_to_update:
+        return
+
+    stored_hash = ApplicationSync.objects.filter(application_id=app_id).values_list('schema_hash', flat=True).first()
+    if check_table or stored_hash != schema_hash:
+        if not modify_table(model_to_update):
+            log_info(app_id, 'ERROR', 'SQL', 'Could not modify table')
+            return
+        ApplicationSync.objects.filter(application_id=app_id).update(schema_hash=schema_hash)
+    return model_to_update
+
+
+def build_model(app_id, app_data, suffix='', db_table=None, indexes=True):
+    """
+    Create the model of the table of an application
+    :param app_id: Podio application ID
+    :param app_data: application as returned by podio
+    :param suffix: added to the name of the model, to create another model than the one of the application table
+    :param db_table: name of the table, the default table of the application if None
+    :param indexes: (True/False). If set to False, the columns are neither unique nor indexed
+    :return: the model or None if an error occurred
+    """
+    model_fields = generate_fields(app_data['fields'])
+    if not model_fields:
+        log_info(app_id, 'ERROR', 'SYSTEM', 'Could not generate fields')
+        return
+    if not indexes:
+        for field in model_fields.values():
+            field._unique = False
+            field.db_index = False
+    app_name = str(slugify(app_data['config']['name']).replace('-', '_'))
+    return create_model(app_name + suffix, fields=model_fields,
+                        app_label=getattr(settings, 'PSYNC_TABLE_PREFIX', 'psync'),
+                        options={'db_table': db_table} if db_table else None)
+
+
 def get_application(app_id, api_object):
     try:
         app_data = api_object.auth.Application.find(app_id)
@@ -59,27 +293,106 @@ def get_application(app_id, api_object):
         return
 
 
-def get_application_items(app_id, api_object, sort_desc=True):
-    try:
-        dict_attributes = {'limit': 500,
-                           'sort_by': 'last_edit_on',
-                           'sort_desc': sort_desc}
-        # we create a loop to take care of the 500 limit
-        app_items = []
-        i = 0
-        result = ['not_empty']  # adding value so we can enter the loop
-        while len(result) > 0:
-            dict_attributes['offset'] = i * 500  # setting the offset
-            result = api_object.auth.Item.filter(int(app_id), dict_attributes)['items']
-            app_items.extend(result)
-            i += 1
-            if len(result) < 500:
-                # if we have less than 500 items, it means that we do not need to fetch again
-                result = []
-        return app_items
-    except Exception as e:
-        logging.error(str(e))
-        return
+def get_application_items(app_id, api_object, sort_desc=True, last_edit_from=None, workers=None, deadline=None,
+                          last_edit_to=None, progress=None, lease=None):
+    """
+    Generator retrieving the items of an application, one page of 500 items at a time.
+    Once the number of items is known from the first page, the next pages are fetched by up to `workers` threads at
+    once. Pages are always yielded in order, and only `workers` pages are fetched ahead of the caller.
+    Errors from Podio are raised to the caller.
+    :param app_id: Podio application ID
+    :param api_object: PodioApi object
+    :param sort_desc: (True/False). Sort the items by last edit date, most recent first
+    :param last_edit_from: datetime. If set, only the items edited since that date are requested
+    :param workers: Number of pages fetched concurrently, PSYNC_FETCH_WORKERS if None
+    :param deadline: timestamp (time.time()) after which SyncTimeout is raised instead of fetching the next page
+    :param last_edit_to: datetime. If set, only the items edited until that date (included) are requested
+    :param progress: function called with the keyword arguments pages_fetched and items_total (number of items
+                     to fetch) whenever a page is fetched
+    :param lease: ApplicationLease held on the application, LeaseLost is raised instead of fetching the next page
+                  once it is lost
+    :return: generator of lists of items
+    """
+    dict_attributes = {'limit': 500,
+                       'sort_by': 'last_edit_on',
+                       'sort_desc': sort_desc}
+    if last_edit_from or last_edit_to:
+        dict_attributes['filters'] = {'last_edit_on': edit_date_filter(last_edit_from, last_edit_to)}
+    if workers is None:
+        workers = int(getattr(settings, 'PSYNC_FETCH_WORKERS', 1))
+
+    def check_deadline():
+        if deadline and time.time() > deadline:
+            raise SyncTimeout('Sync of application %s timed out' % app_id)
+        if lease:
+            lease.check()
+
+    def fetch_page(offset):
+        attributes = dict(dict_attributes, offset=offset)
+        return api_object.auth.Item.filter(int(app_id), attributes)
+
+    pages_fetched = [0]
+
+    def report():
+        pages_fetched[0] += 1
+        if progress:
+            progress(pages_fetched=pages_fetched[0], items_total=total)
+
+    check_deadline()
+    first_page = api_object.auth.Item.filter(int(app_id), dict(dict_attributes, offset=0))
+    result = first_page['items']
+    total = first_page.get('filtered', first_page.get('total'))
+    report()
+    if result:
+        yield result
+    offset = 500
+    if len(result) == 500 and workers > 1 and total:
+        pool = ThreadPool(workers)
+        try:
+            for offsets in chunks(range(offset, total, 500), workers):
+                check_deadline()
+                for page in pool.map(fetch_page, offsets):
+                    result = page['items']
+                    report()
+                    if result:
+                        yield result
+                offset = offsets[-1] + 500
+        finally:
+            pool.terminate()
+    # we create a loop to take care of the 500 limit (and of the items added since the first page was fetched)
+    while len(result) == 500:
+        check_deadline()
+        result = api_object.auth.Item.filter(int(app_id), dict(dict_attributes, offset=offset))['items']
+        report()
+        if result:
+            yield result
+        offset += 500
+
+
+def edit_date_filter(date_from=None, date_to=None):
+    """
+    Podio filter on a range of dates, both ends included
+    :param date_from: datetime or None
+    :param date_to: datetime or None
+    :return: dictionary
+    """
+    date_filter = {}
+    if date_from:
+        date_filter['from'] = format_podio_date(date_from)
+    if date_to:
+        date_filter['to'] = format_podio_date(date_to)
+    return date_filter
+
+
+def format_podio_date(value):
+    """
+    Format a datetime the way Podio expects it in filters (UTC, 'YYYY-MM-DD HH:MM:SS')
+    :param value: naive (UTC) or aware datetime
+    :return: string
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(pytz.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
 
 
 def generate_fields(model_fields):
@@ -92,10 +405,20 @@ def generate_fields(model_fields):
     try:
         fields = {'item_id': models.IntegerField(verbose_name='Item ID',
                                                  blank=True,
-                                                 null=True),
+                                                 null=True,
+                                                 unique=True),
                   'date_updated': models.DateTimeField(verbose_name='Date last updated',
                                                        blank=True,
-                                                       null=True)}
+                                                       null=True,
+                                                       db_index=getattr(settings, 'PSYNC_INDEX_DATE_UPDATED', False)),
+                  'date_edited': models.DateTimeField(verbose_name='Date last edited in podio',
+                                                      blank=True,
+                                                      null=True,
+                                                      db_index=True),
+                  'row_hash': models.CharField(verbose_name='Hash of the row values',
+                                               max_length=32,
+                                               blank=True,
+                                               null=True)}
         for field in model_fields:
             f_type = field['type']
             f_status = field['status']
@@ -183,6 +506,11 @@ def create_model(name, fields=None, app_label='', module='', options=None, admin
         if fields:
             attrs.update(fields)
 
+        # A previous version of this model would be replaced with a warning by Django, we remove it first
+        previous_model = apps.all_models.get(app_label, {}).get(name.lower())
+        if previous_model is not None:
+            unregister_model(previous_model)
+
         # Create the class, which automatically triggers ModelBase processing
         model = type(name, (models.Model,), attrs)
 
@@ -230,7 +558,7 @@ def create_table(model_class, database=None):
 
 def modify_table(model_class, database=None):
     """
-    Alter the table by adding / removing columns.
+    Alter the table by adding / removing columns and adding the missing indexes.
     :param model_class: the model containing the fields (columns) to use
     :param database: The database string. if None, the default one will be used.
     :return: True if successful or None if failed
@@ -253,8 +581,7 @@ def modify_table(model_class, database=None):
             field_output.append("NULL")  # we force the field to be NULL to prevent insert error
             if field.primary_key:
                 field_output.append("PRIMARY KEY")
-            elif field.unique:
-                field_output.append("UNIQUE")
+            # unique columns get their index from add_missing_indexes, some backends cannot add a UNIQUE column
             sql_add_column = "ALTER TABLE %s ADD COLUMN %s" % (table_name, ' '.join(field_output))
 
             # db.add_column(table_name, column_name, field)
@@ -278,169 +605,202 @@ def modify_table(model_class, database=None):
                 except OperationalError, e:
                     # we cannot delete the column, we just ignore this
                     logger.error(str(e))
+    return add_missing_indexes(model_class, database)
+
+
+def add_missing_indexes(model_class, database=None, index_prefix=None):
+    """
+    Create the unique and plain indexes declared by the model that do not exist on its table yet.
+    Duplicated rows are removed (the most recent one is kept) before creating a unique index.
+    :param model_class: the model containing the fields (columns) to use
+    :param database: The database string. if None, the default one will be used.
+    :param index_prefix: start of the names of the indexes, the name of the table if None
+    :return: True if successful or None if failed
+    """
+    if not database:
+        database = DEFAULT_DB_ALIAS
+    if not index_prefix:
+        index_prefix = model_class._meta.db_table
+    connection = connections[database]
+    qn = connection.ops.quote_name
+    table_name = model_class._meta.db_table
+    pk_column = model_class._meta.pk.column
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table_name).values()
+    for field in model_class._meta.fields:
+        if field.primary_key or not (field.unique or field.db_index):
+            continue
+        indexes = [c for c in constraints if c['columns'] == [field.column] and (c['unique'] or c['index'])]
+        if field.unique:
+            indexes = [c for c in indexes if c['unique']]
+        if indexes:
+            continue
+        index_name = '%s_%s_%s' % (index_prefix, field.column, 'uniq' if field.unique else 'idx')
+        sql_create_index = "CREATE %sINDEX %s ON %s (%s)" % ('UNIQUE ' if field.unique else '',
+                                                            qn(index_name), qn(table_name), qn(field.column))
+        with connection.cursor() as cursor:
+            try:
+                if field.unique:
+                    cursor.execute("DELETE FROM %(table)s WHERE %(column)s IS NOT NULL AND %(pk)s NOT IN "
+                                   "(SELECT keep_id FROM (SELECT MAX(%(pk)s) AS keep_id FROM %(table)s "
+                                   "WHERE %(column)s IS NOT NULL GROUP BY %(column)s) AS keep)"
+                                   % {'table': qn(table_name), 'column': qn(field.column), 'pk': qn(pk_column)})
+                cursor.execute(sql_create_index)
+            except (OperationalError, IntegrityError) as e:
+                logger.critical(str(e))
+                return
     return True
 
 
-def update_table(model_class, app_id, items, database=None):
+def update_table(model_class, app_id, items, converter, database=None, full_sync=False, synced_at=None,
+                 record_sync=True, progress=None, checkpoint=None, run_id=None, lease=None):
     """
     This function update the table with data as necessary
     :param model_class: The model to use to update the DB
     :param app_id: The Application to use to retrieve the data
-    :param items: The items to update the DB with
+    :param items: Iterable of pages (lists) of items to update the DB with, such as get_application_items
+    :param converter: RowConverter built from the fields of the application
     :param database: The name of the database to use
-    :return: True if successful, None if not
+    :param full_sync: (True/False). If set to True, all items are updated whatever their last revision date
+    :param synced_at: datetime to store as last_synced. Defaults to now
+    :param record_sync: (True/False). If set to False, last_synced is left as is, for partial updates
+    :param progress: function called with the keyword arguments items_written and items_skipped whenever a batch
+                     is written, in the calling thread
+    :param checkpoint: function called with the oldest revision date of the items written, whenever a batch is
+                       written. As pages are written in order, every item edited since then is in the table
+    :param run_id: ID of the sync, recorded with the items that could not be converted or written. Such items are
+                   stored in DeadLetterItem and the sync goes on without them
+    :param lease: ApplicationLease held on the application, checked before every write: nothing is written once
+                  another worker may have taken the application
+    :return: dictionary with the number of items updated if successful, None if not
     """
     if not database:
         database = DEFAULT_DB_ALIAS
     # getting the last update time
-    app_last_updated = pytz.utc.localize(parser.parse('1900-01-01 00:00:00'))
+    app_last_updated = datetime.datetime(1900, 1, 1, tzinfo=pytz.utc)
     try:
         app_object = ApplicationSync.objects.get(application_id=app_id)
     except ApplicationSync.DoesNotExist:
         return
-    if app_object.last_synced:
+    if app_object.last_synced and not full_sync:
         app_last_updated = app_object.last_synced
-    items_updated = False
-    items_counter = 0
-    for item in items:
-        update_item = False
-        item_id = item['item_id']
-        item_last_updated = pytz.utc.localize(parser.parse(item['current_revision']['created_on']))
-        if item_last_updated > app_last_updated:
-            update_item = True
-        if update_item:
-            try:
-                with transaction.atomic(using=database):
-                    try:
-                        db_item = model_class.objects.using(database).get(item_id=item_id)
-                    except model_class.DoesNotExist:
-                        db_item = model_class(item_id=item_id)
-                    try:
-                        for field in item['fields']:
-                            field_name = field['external_id']
-                            field_type = field['type']
-                            if field_type == 'date':
-                                # we need to update the start and end
-                                date_start = get_value_for_field(field)
-                                date_end = get_value_for_field(field, date='end')
-                                if date_start:
-                                    date_start = pytz.utc.localize(date_start)
-                                if date_end:
-                                    date_end = pytz.utc.localize(date_end)
-                                db_item.__dict__['%s' % field_name] = date_start
-                                db_item.__dict__['%s_end' % field_name] = date_end
-                            elif field_type == 'app':
-                                # we update the field name and its reference.
-                                db_item.__dict__[field_name] = get_value_for_field(field)
-                                db_item.__dict__['%s_ref' % field_name] = get_value_for_field(field, app=True)
-                            elif field_type == 'money':
-                                # we update the field name and its reference.
-                                db_item.__dict__[field_name] = get_value_for_field(field)
-                                db_item.__dict__['%s_currency' % field_name] = get_value_for_field(field, extra='money')
-                            else:
-                                db_item.__dict__[field_name] = get_value_for_field(field)
-                            db_item.date_updated = pytz.utc.localize(datetime.datetime.now())
-                        db_item.save(using=database)
-                    except Exception as e:
-                        logger.error(str(e))
-                        return
-                items_updated = True
-                items_counter += 1
-            except IntegrityError, e:
-                logger.error(str(e))
-                return
-    if items_updated:
-        msg = '%s items updated for table: %s' % (items_counter, model_class._meta.db_table)
+    batch_size = get_batch_size()
+    counters = {'written': 0, 'skipped': 0, 'failed': 0}
+    rows = []
+    item_id_index = converter.columns.index('item_id')
+    edited_index = converter.columns.index('date_edited')
+
+    def dead_letter(item_id, error):
+        logger.error('Item %s: %s' % (item_id, error))
+        DeadLetterItem.objects.create(application=app_object, item_id=item_id, sync_run_id=run_id,
+                                      error='%s' % error)
+        counters['failed'] += 1
+
+    def check_lease():
+        if lease:
+            lease.check()
+
+    def flush():
+        check_lease()
+        inserted, updated, skipped = write_rows(model_class, converter.columns, rows, database=database,
+                                                batch_size=batch_size,
+                                                on_error=lambda row, e: dead_letter(row[item_id_index], e))
+        counters['written'] += inserted + updated
+        counters['skipped'] += skipped
+        dates_edited = [row[edited_index] for row in rows if row[edited_index]]
+        del rows[:]
+        if checkpoint and dates_edited:
+            checkpoint(min(dates_edited))
+        if progress:
+            progress(items_written=counters['written'], items_skipped=counters['skipped'])
+
+    def write(result):
+        page_rows, failures = result
+        for item_id, error in failures:
+            dead_letter(item_id, error)
+        rows.extend(page_rows)
+        if len(rows) >= batch_size:
+            flush()
+
+    try:
+        run_pipeline(items, functools.partial(page_to_rows, converter=converter, last_updated=app_last_updated), write)
+        if rows:
+            flush()
+    except StageError as e:
+        logger.error(str(e))
+        if e.stage == 'fetch':
+            # Podio could not give us the next page, we stop here and keep last_synced as is. The pages
+            # fetched so far are written, the next sync resumes from them
+            log_info(app_id, 'ERROR', 'PODIO', 'Could not retrieve items from podio: %s' % e.error)
+            if rows:
+                try:
+                    flush()
+                except (IntegrityError, OperationalError, LeaseLost) as e:
+                    logger.error(str(e))
+        return
+    except (IntegrityError, OperationalError, LeaseLost) as e:
+        logger.error(str(e))
+        return
+    items_counter = counters['written']
+    if counters['failed']:
+        msg = '%s items could not be updated in table: %s, see the dead letter items of run %s' % (
+            counters['failed'], model_class._meta.db_table, run_id)
+        logger.error(msg)
+        log_info(app_id, 'ERROR', 'UPDATE', msg)
+    if items_counter or counters['skipped']:
+        msg = '%s items updated for table: %s (%s unchanged items skipped)' % (items_counter,
+                                                                              model_class._meta.db_table,
+                                                                              counters['skipped'])
         logger.info(msg)
-        log_info(app_id, 'SUCCESS', 'SQL', msg)
+        log_info(app_id, 'SUCCESS', 'SQL', msg, items_written=items_counter, items_skipped=counters['skipped'])
     else:
         msg = 'No item to update'
         logger.info(msg)
-        log_info(app_id, 'INFO', 'SQL', msg)
+        log_info(app_id, 'INFO', 'SQL', msg, items_written=0, items_skipped=0)
 
-    app_object.last_synced = pytz.utc.localize(datetime.datetime.now())
-    app_object.save()
+    if not record_sync:
+        return {'items_updated': items_counter}
+    try:
+        check_lease()
+    except LeaseLost as e:
+        # the worker holding the lease now records its own sync
+        logger.error(str(e))
+        return
+    app_object.last_synced = synced_at or pytz.utc.localize(datetime.datetime.utcnow())
+    # the sync is over, there is nothing to resume
+    app_object.sync_run_id = None
+    app_object.sync_started = None
+    app_object.sync_from = None
+    app_object.sync_cursor = None
+    # other fields (e.g. the lease) are updated by other threads meanwhile
+    app_object.save(update_fields=['last_synced', 'sync_run_id', 'sync_started', 'sync_from', 'sync_cursor'])
     msg = 'Table %s synchronised (app_id: %s, app_name: %s)' % (model_class._meta.db_table,
                                                                 app_id,
                                                                 app_object.application_name)
     logger.info(msg)
     log_info(app_id, 'SUCCESS', 'SQL', msg)
-    return True
+    return {'items_updated': items_counter}
 
 
-def get_value_for_field(field, prof_id=False, date=None, app=False, extra=None):
+def page_to_rows(page, converter, last_updated):
     """
-    .. function::
-
-        :description: retrieve the value for a field from podio item
-        :param field: This is a field from an item, it should contain all data
-        :param prof_id: (True/False). to be set to true if the field needs to be considered as a 'Contact' field
-        :param date: (end/None). if set to 'end' we will extract the end date from the field. None will get the start date
-        :param app: (True/False). If set to True, the value returned is the item_id rather than the string
-        :rtype: a string containing the field's value
-        :raises:
-
+    Convert the items of a page that were modified after last_updated into rows
+    :param page: list of items as returned by podio
+    :param converter: RowConverter of the application
+    :param last_updated: aware datetime
+    :return: tuple (list of rows (tuples in the order of converter.columns), list of (item ID, error) of the
+             items that could not be converted)
     """
-
-    field_type = field['type']
-    value = ''
-    try:
-        if field_type == 'date':
-            if date == 'end':
-                if 'end' in field['values'][0]:
-                    value = parser.parse(field['values'][0]['end'])
-                else:
-                    value = None
-            else:
-                value = parser.parse(field['values'][0]['start'])
-
-        elif field_type == 'text':
-            value = smart_str(field['values'][0]['value'])
-        elif field_type == 'number':
-            value = [smart_str(val['value']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'progress':
-            value = [smart_str(val['value']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'category':
-            value = [smart_str(val['value']['text']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'email':
-            value = [smart_str(val['value']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'phone':
-            value = [smart_str(val['value']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'money':
-            if extra == 'money':
-                value = smart_str(field['values'][0]['currency'])
-            else:
-                value = smart_str(field['values'][0]['value'])
-        elif field_type == 'duration':
-            value = [smart_str(val['value']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'contact':
-            if prof_id:
-                value = [int(val['value']['profile_id']) for val in field['values']]
-            else:
-                value = [smart_str(val['value']['name']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'app':
-            if not app:
-                value = [smart_str(val['value']['title']) for val in field['values']]
-            else:
-                value = [int(val['value']['item_id']) for val in field['values']]
-            value = ', '.join(map(str, value))
-        elif field_type == 'image':
-            value = field['values'][0]['value']['link']
-        elif field_type == 'location':
-            value = field['values'][0]['formatted']
-    except Exception as e:
-        logger.error(str(e))
-
-    if isinstance(value, str):
-        value = value.decode('utf-8')
-    return value
+    rows = []
+    failures = []
+    date_updated = datetime.datetime.now(pytz.utc)
+    for item in page:
+        try:
+            if parse_podio_datetime(item['current_revision']['created_on']) > last_updated:
+                rows.append(converter(item, date_updated))
+        except Exception as e:
+            failures.append((item.get('item_id'), '%s: %s' % (e.__class__.__name__, e)))
+    return rows, failures
 
 
 def get_app_details(app_id, podio_key_id):
@@ -449,13 +809,15 @@ def get_app_details(app_id, podio_key_id):
     return get_application(app_id, podio_api)
 
 
-def log_info(application, result, section, message):
+def log_info(application, result, section, message, items_written=None, items_skipped=None):
     try:
         app = ApplicationSync.objects.get(application_id=application)
         new_entry = SyncLog(application=app,
                             result=result,
                             section=section,
-                            message=message)
+                            message=message,
+                            items_written=items_written,
+                            items_skipped=items_skipped)
         new_entry.save()
         return True
     except ApplicationSync.DoesNotExist as e:
@@ -1,16 +1,18 @@
 import json
-import datetime
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ObjectDoesNotExist
 from django.template.loader import get_template
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.template import RequestContext
 
-from podiosync.models import PodioKey, ApplicationSync, SyncLog
+from podiosync.models import PodioKey, ApplicationSync, SyncJob, SyncLog, WebhookEvent, HOOK_EVENTS
 from podiosync.api import PodioApi
 from podiosync.forms import PodioKeyForm
 
-from podiosync.utils import sync_application, get_app_details
+from podiosync.jobs import get_job_status, submit_job
+from podiosync.utils import get_app_details
 
 
 # Create your views here.
@@ -95,7 +97,8 @@ def application_sync(request, action_sync, application_id):
         elif action_sync == 'remove':
             app_to_update.application_enabled = False
         app_to_update.application_url = application_url
-        app_to_update.save()
+        # the sync and lease fields are updated by the workers meanwhile
+        app_to_update.save(update_fields=['application_enabled', 'application_url'])
         msg['result'] = 'success'
         msg['msg'] = 'Application updated'
     except ApplicationSync.DoesNotExist:
@@ -124,19 +127,58 @@ def sync_list(request):
 
 
 def application_sync_data(request):
+    """
+    Queue the sync of an application, it is run by psync_worker. The progress of the job is given by sync_job.
+    """
     msg = {'result': 'error'}
     application_id = request.POST.get('application_id', None)
     podio_key_id = request.POST.get('podio_key_id', None)
+    full_sync = request.POST.get('full_sync', None) == 'true'
     try:
-        podio_key = PodioKey.objects.get(id=podio_key_id)
-        msg = sync_application(application_id, podio_key.podio_user.user_name)
-        msg['last_synced'] = datetime.datetime.now().strftime('%b %d, %Y, %I:%M %p')
-    except ObjectDoesNotExist:
+        app_sync = ApplicationSync.objects.get(application_id=application_id, podio_key_id=podio_key_id)
+        job = submit_job(app_sync, full_sync=full_sync)
+        msg = {'result': job.status,
+               'job_id': job.pk,
+               'status_url': reverse('sync-job', kwargs={'job_id': job.pk})}
+    except (ObjectDoesNotExist, ValueError):
         pass
 
     return HttpResponse(json.dumps(msg), content_type="application/json")
 
 
+def sync_job(request, job_id):
+    try:
+        job = SyncJob.objects.select_related('application').get(pk=job_id)
+    except ObjectDoesNotExist:
+        raise Http404
+    return HttpResponse(json.dumps(get_job_status(job)), content_type="application/json")
+
+
+@csrf_exempt
+@require_POST
+def webhook(request, application_id):
+    """
+    Receive the events sent by the podio hooks of an application (see psync_hooks).
+    Changed items are queued, they are retrieved from podio when the queue is applied.
+    """
+    # the same application can be synchronised with several podio keys, the events are queued once
+    app_sync = ApplicationSync.objects.select_related('podio_key__podio_user').filter(
+        application_id=application_id, application_enabled=True).order_by('pk').first()
+    if app_sync is None:
+        raise Http404
+    event_type = request.POST.get('type')
+    if event_type == 'hook.verify':
+        podio_api = PodioApi(app_sync.podio_key.podio_user.user_name)
+        podio_api.auth.Hook.validate(request.POST.get('hook_id'), request.POST.get('code'))
+    elif event_type in dict(HOOK_EVENTS):
+        try:
+            item_id = int(request.POST.get('item_id'))
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest()
+        WebhookEvent.objects.create(application=app_sync, item_id=item_id, event_type=event_type)
+    return HttpResponse()
+
+
 def history(request, application_id=None):
     t = get_template('history_list.html')
     history_list = None
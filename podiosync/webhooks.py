@@ -0,0 +1,105 @@
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db.models import Max
+
+from podiosync.api import PodioApi
+from podiosync.leases import ApplicationLease, LeaseUnavailable
+from podiosync.models import ApplicationSync, WebhookEvent, HOOK_EVENTS
+from podiosync.utils import log_info, refresh_items
+
+logger = logging.getLogger(__name__)
+
+
+def get_hook_url(app_id, base_url=None):
+    """
+    URL podio sends the events of an application to
+    :param app_id: Podio application ID
+    :param base_url: Public URL of the site (scheme and host), PSYNC_WEBHOOK_URL if None
+    :return: string
+    """
+    if base_url is None:
+        base_url = getattr(settings, 'PSYNC_WEBHOOK_URL', '')
+    return '%s%s' % (base_url.rstrip('/'), reverse('webhook', kwargs={'application_id': app_id}))
+
+
+def register_hooks(app_sync, base_url=None):
+    """
+    Create the hooks of an application (one per event type) if they do not exist yet, and ask podio to verify the
+    ones that are not active. Podio then sends a hook.verify event, validated by the webhook view.
+    :param app_sync: ApplicationSync object
+    :param base_url: Public URL of the site (scheme and host), PSYNC_WEBHOOK_URL if None
+    :return: dictionary with message (and the number of hooks created and verified if successful)
+    """
+    msg = {'result': 'error'}
+    hook_url = get_hook_url(app_sync.application_id, base_url)
+    podio_api = PodioApi(app_sync.podio_key.podio_user.user_name)
+    try:
+        hooks = dict((hook['type'], hook) for hook in podio_api.auth.Hook.find_all_for('app', app_sync.application_id)
+                     if hook['url'] == hook_url)
+        created = 0
+        verified = 0
+        for event_type, label in HOOK_EVENTS:
+            hook = hooks.get(event_type)
+            if hook is None:
+                hook = podio_api.auth.Hook.create('app', app_sync.application_id, {'url': hook_url,
+                                                                                  'type': event_type})
+                created += 1
+            if hook.get('status') != 'active':
+                podio_api.auth.Hook.verify(hook['hook_id'])
+                verified += 1
+    except Exception as e:
+        logger.error(str(e))
+        log_info(app_sync.application_id, 'ERROR', 'PODIO', 'Could not register hooks: %s' % e)
+        return msg
+    msg['result'] = 'success'
+    msg['hooks_created'] = created
+    msg['hooks_verified'] = verified
+    return msg
+
+
+def apply_events(application_ids=None, database=None):
+    """
+    Apply the events received from podio so far. Events are coalesced: every item changed (or deleted) is
+    retrieved once per application whatever the number of events, the items not found in podio are deleted.
+    Events are removed from the queue once applied, they are kept if their application could not be updated or
+    is being synchronised by another worker (see ApplicationLease).
+    :param application_ids: Only apply the events of these applications (Podio application IDs)
+    :param database: The name of the database to use
+    :return: list of dictionaries (application, result, items_updated, items_deleted), one per application
+    """
+    events = WebhookEvent.objects.all()
+    if application_ids:
+        events = events.filter(application__application_id__in=application_ids)
+    # events received while we are applying these ones are left for the next run
+    last_id = events.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        return []
+    events = events.filter(id__lte=last_id)
+    item_ids = OrderedDict()
+    for app_pk, item_id in events.order_by('id').values_list('application', 'item_id'):
+        item_ids.setdefault(app_pk, set()).add(item_id)
+
+    summaries = []
+    app_syncs = ApplicationSync.objects.select_related('podio_key__podio_user').in_bulk(list(item_ids))
+    for app_pk, app_item_ids in item_ids.items():
+        app_sync = app_syncs[app_pk]
+        if not app_sync.application_enabled:
+            msg = {'result': 'disabled'}
+        else:
+            try:
+                with ApplicationLease(app_sync) as lease:
+                    msg = refresh_items(app_sync.application_id, app_sync.podio_key.podio_user.user_name,
+                                        app_item_ids, database=database, delete_missing=True, lease=lease)
+            except LeaseUnavailable as e:
+                logger.info(str(e))
+                msg = {'result': 'busy'}
+        if msg['result'] in ('success', 'disabled'):
+            events.filter(application=app_pk).delete()
+        summaries.append({'application': app_sync,
+                          'result': msg['result'],
+                          'items_updated': msg.get('items_updated', 0),
+                          'items_deleted': msg.get('items_deleted', 0)})
+    return summaries
@@ -0,0 +1,192 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, DataError, IntegrityError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# errors caused by the values of a row rather than by the DB itself
+ROW_ERRORS = (DataError, IntegrityError, ValidationError, TypeError, ValueError)
+
+
+def get_batch_size():
+    return int(getattr(settings, 'PSYNC_BATCH_SIZE', 500))
+
+
+def chunks(values, size):
+    """
+    Split a list in lists of at most size elements
+    """
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def write_rows(model_class, columns, rows, database=None, batch_size=None, on_error=None):
+    """
+    Insert or update rows in the table of a generated model, one transaction per batch.
+    Existing item_ids are fetched in one query per batch, new rows are inserted with bulk_create and
+    existing rows are updated with a single executemany statement. If columns contain row_hash, existing rows
+    with the same hash are not updated (apart from their date_edited column if it changed).
+    :param model_class: The model of the table to write to
+    :param columns: list of the column names of the rows, it must contain item_id
+    :param rows: list of tuples of values, in the order of columns
+    :param database: The name of the database to use, if None the default one is used
+    :param batch_size: Number of rows per transaction, PSYNC_BATCH_SIZE if None
+    :param on_error: function called with a row and the error raised when writing it. If set, the rows of a batch
+                     that fails are written one at a time and the ones that still fail are handed to on_error
+                     rather than raising the error
+    :return: tuple (number of rows inserted, number of rows updated, number of unchanged rows skipped)
+    """
+    if not database:
+        database = DEFAULT_DB_ALIAS
+    if not batch_size:
+        batch_size = get_batch_size()
+    inserted = 0
+    updated = 0
+    skipped = 0
+    for batch in chunks(rows, batch_size):
+        try:
+            batch_inserted, batch_updated, batch_skipped = write_batch(model_class, columns, batch, database)
+        except ROW_ERRORS as e:
+            if on_error is None:
+                raise
+            logger.error(str(e))
+            batch_inserted, batch_updated, batch_skipped = write_one_by_one(model_class, columns, batch, database,
+                                                                            on_error)
+        inserted += batch_inserted
+        updated += batch_updated
+        skipped += batch_skipped
+    return inserted, updated, skipped
+
+
+def insert_rows(model_class, columns, rows, database=None, batch_size=None, on_error=None):
+    """
+    Insert rows with bulk_create, one transaction per batch, without looking for existing rows (e.g. in a table
+    being loaded). See write_rows for on_error
+    :return: number of rows inserted
+    """
+    if not database:
+        database = DEFAULT_DB_ALIAS
+    if not batch_size:
+        batch_size = get_batch_size()
+    inserted = 0
+    for batch in chunks(rows, batch_size):
+        try:
+            with transaction.atomic(using=database):
+                model_class.objects.using(database).bulk_create([model_class(**dict(zip(columns, row)))
+                                                                 for row in batch])
+            inserted += len(batch)
+        except ROW_ERRORS as e:
+            if on_error is None:
+                raise
+            if len(batch) == 1:
+                on_error(batch[0], e)
+            else:
+                # the rows are inserted one at a time to find the ones failing
+                logger.error(str(e))
+                inserted += insert_rows(model_class, columns, batch, database=database, batch_size=1,
+                                        on_error=on_error)
+    return inserted
+
+
+def write_one_by_one(model_class, columns, rows, database, on_error):
+    """
+    Write the rows of a batch that failed one at a time. See write_rows
+    """
+    inserted = 0
+    updated = 0
+    skipped = 0
+    for row in rows:
+        try:
+            row_inserted, row_updated, row_skipped = write_batch(model_class, columns, [row], database)
+        except ROW_ERRORS as e:
+            on_error(row, e)
+            continue
+        inserted += row_inserted
+        updated += row_updated
+        skipped += row_skipped
+    return inserted, updated, skipped
+
+
+def write_batch(model_class, columns, rows, database):
+    """
+    Write one batch of rows in a single transaction. See write_rows
+    """
+    connection = connections[database]
+    fields = [model_class._meta.get_field(column) for column in columns]
+    item_id_index = columns.index('item_id')
+    hash_index = columns.index('row_hash') if 'row_hash' in columns else None
+    edited_index = columns.index('date_edited') if 'date_edited' in columns else None
+    # the same item can be returned twice by podio if it was edited while we were paging, first one wins
+    unique_rows = {}
+    for row in rows:
+        unique_rows.setdefault(row[item_id_index], row)
+
+    with transaction.atomic(using=database):
+        existing = {}
+        # some backends (SQLite) limit the number of parameters of a query
+        for item_ids in chunks(list(unique_rows), 500):
+            for item_id, pk, current_hash, current_edited in (model_class.objects.using(database)
+                                                              .filter(item_id__in=item_ids)
+                                                              .values_list('item_id', 'pk', 'row_hash',
+                                                                           'date_edited')):
+                existing[item_id] = (pk, current_hash, current_edited)
+        new_objects = []
+        update_params = []
+        edited_params = []
+        skipped = 0
+        for item_id, row in unique_rows.items():
+            if item_id in existing:
+                pk, current_hash, current_edited = existing[item_id]
+                if hash_index is not None and current_hash == row[hash_index]:
+                    skipped += 1
+                    if edited_index is not None and current_edited != row[edited_index]:
+                        # the content did not change but we keep track of the edit date reported by podio
+                        edited_params.append([fields[edited_index].get_db_prep_save(row[edited_index],
+                                                                                   connection=connection), pk])
+                    continue
+                params = [f.get_db_prep_save(value, connection=connection) for f, value in zip(fields, row)]
+                params.append(pk)
+                update_params.append(params)
+            else:
+                new_objects.append(model_class(**dict(zip(columns, row))))
+        if new_objects:
+            model_class.objects.using(database).bulk_create(new_objects)
+        qn = connection.ops.quote_name
+        if update_params:
+            sql_update = "UPDATE %s SET %s WHERE %s = %%s" % (
+                qn(model_class._meta.db_table),
+                ', '.join('%s = %%s' % qn(f.column) for f in fields),
+                qn(model_class._meta.pk.column))
+            with connection.cursor() as cursor:
+                cursor.executemany(sql_update, update_params)
+        if edited_params:
+            sql_update = "UPDATE %s SET %s = %%s WHERE %s = %%s" % (
+                qn(model_class._meta.db_table),
+                qn('date_edited'),
+                qn(model_class._meta.pk.column))
+            with connection.cursor() as cursor:
+                cursor.executemany(sql_update, edited_params)
+    return len(new_objects), len(update_params), skipped
+
+
+def delete_rows(model_class, item_ids, database=None, batch_size=None):
+    """
+    Delete the rows of the given items from the table of a generated model, one transaction per batch
+    :param model_class: The model of the table
+    :param item_ids: list of Podio item IDs
+    :param database: The name of the database to use, if None the default one is used
+    :param batch_size: Number of rows per transaction, PSYNC_BATCH_SIZE if None
+    :return: number of rows deleted
+    """
+    if not database:
+        database = DEFAULT_DB_ALIAS
+    if not batch_size:
+        batch_size = get_batch_size()
+    deleted = 0
+    # some backends (SQLite) limit the number of parameters of a query
+    for batch in chunks(sorted(item_ids), min(batch_size, 500)):
+        with transaction.atomic(using=database):
+            deleted += model_class.objects.using(database).filter(item_id__in=batch).delete()[0]
+    return deleted
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from . import transport, client
+from . import transport, client, async_client
 
 
 def build_headers(authorization_headers, user_agent):
@@ -10,22 +10,72 @@ def build_headers(authorization_headers, user_agent):
 
 
 def OAuthClient(api_key, api_secret, login, password, user_agent=None,
-                domain="https://api.podio.com"):
+                domain="https://api.podio.com", pool=None, token=None, on_refresh=None, on_reject=None,
+                rate_limiter=None):
     auth = transport.OAuthAuthorization(login, password,
-                                        api_key, api_secret, domain)
-    return AuthorizingClient(domain, auth, user_agent=user_agent)
+                                        api_key, api_secret, domain, pool=pool,
+                                        token=token, on_refresh=on_refresh, on_reject=on_reject)
+    return AuthorizingClient(domain, auth, user_agent=user_agent, pool=pool, rate_limiter=rate_limiter)
 
 
 def OAuthAppClient(client_id, client_secret, app_id, app_token, user_agent=None,
-                   domain="https://api.podio.com"):
+                   domain="https://api.podio.com", pool=None):
 
     auth = transport.OAuthAppAuthorization(app_id, app_token,
-                                           client_id, client_secret, domain)
+                                           client_id, client_secret, domain, pool=pool)
 
-    return AuthorizingClient(domain, auth, user_agent=user_agent)
+    return AuthorizingClient(domain, auth, user_agent=user_agent, pool=pool)
 
 
-def AuthorizingClient(domain, auth, user_agent=None):
-    """Creates a Podio client using an auth object."""
-    http_transport = transport.HttpTransport(domain, build_headers(auth, user_agent))
+def AuthorizingClient(domain, auth, user_agent=None, pool=None, rate_limiter=None, max_retries=5):
+    """
+    Creates a Podio client using an auth object. Connections are taken from pool (a transport.HttpPool)
+    and requests are paced by rate_limiter (a transport.RateLimiter), which should be shared by the clients
+    using the same credentials.
+    """
+    http_transport = transport.HttpTransport(domain, build_headers(auth, user_agent), pool=pool,
+                                             rate_limiter=rate_limiter, max_retries=max_retries,
+                                             authorization=auth)
     return client.Client(http_transport)
+
+
+def async_pool(max_concurrency):
+    """Return an HttpPool letting max_concurrency requests run at the same time, even against a single host"""
+    return transport.HttpPool(max_size=max_concurrency, per_host=max_concurrency)
+
+
+def OAuthAsyncClient(api_key, api_secret, login, password, user_agent=None,
+                     domain="https://api.podio.com", pool=None, token=None, on_refresh=None, on_reject=None,
+                     rate_limiter=None, max_concurrency=10):
+    if pool is None:
+        pool = async_pool(max_concurrency)
+    auth = transport.OAuthAuthorization(login, password,
+                                        api_key, api_secret, domain, pool=pool,
+                                        token=token, on_refresh=on_refresh, on_reject=on_reject)
+    return AuthorizingAsyncClient(domain, auth, user_agent=user_agent, pool=pool, rate_limiter=rate_limiter,
+                                  max_concurrency=max_concurrency)
+
+
+def OAuthAppAsyncClient(client_id, client_secret, app_id, app_token, user_agent=None,
+                        domain="https://api.podio.com", pool=None, max_concurrency=10):
+    if pool is None:
+        pool = async_pool(max_concurrency)
+    auth = transport.OAuthAppAuthorization(app_id, app_token,
+                                           client_id, client_secret, domain, pool=pool)
+
+    return AuthorizingAsyncClient(domain, auth, user_agent=user_agent, pool=pool, max_concurrency=max_concurrency)
+
+
+def AuthorizingAsyncClient(domain, auth, user_agent=None, pool=None, rate_limiter=None, max_retries=5,
+                           max_concurrency=10):
+    """
+    Creates a Podio client running up to max_concurrency requests at the same time. See AuthorizingClient.
+    Without a pool, the client gets its own one sized for max_concurrency requests (see async_pool), the pool
+    shared by default only runs a few requests at once.
+    """
+    if pool is None:
+        pool = async_pool(max_concurrency)
+    http_transport = transport.HttpTransport(domain, build_headers(auth, user_agent), pool=pool,
+                                             rate_limiter=rate_limiter, max_retries=max_retries,
+                                             authorization=auth)
+    return async_client.AsyncClient(http_transport, max_concurrency=max_concurrency)
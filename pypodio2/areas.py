@@ -98,6 +98,8 @@ class Item(Area):
         if not isinstance(attributes, dict):
             raise TypeError('Must be of type dict')
         attributes = json.dumps(attributes)
+        # filtering does not change anything, it can be retried safely
+        kwargs.setdefault('idempotent', True)
         return self.transport.POST(url="/item/app/%d/filter/" % app_id, body=attributes,
                                    type="application/json", **kwargs)
 
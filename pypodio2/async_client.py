@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from multiprocessing.pool import ThreadPool
+
+from . import areas
+
+
+class AsyncArea(object):
+    """
+    Wraps an Area so that calling one of its methods runs it on the client's pool and returns at once
+    an AsyncResult (use .get() to wait for the value, errors are raised there).
+    """
+
+    def __init__(self, area, pool):
+        self._area = area
+        self._pool = pool
+
+    def __getattr__(self, name):
+        method = getattr(self._area, name)
+        if not callable(method):
+            return method
+
+        def submit(*args, **kwargs):
+            return self._pool.apply_async(method, args, kwargs)
+        return submit
+
+
+class AsyncClient(object):
+    """
+    Podio API client running the requests on a bounded pool of threads, with the same areas as Client:
+    client.Item.filter(app_id, attributes) returns an AsyncResult instead of the response.
+    The transport (and so the authorization and error handling) is the one of the blocking client.
+    Callers should use the factory methods OAuthAsyncClient / OAuthAppAsyncClient to create instances.
+
+    :param transport: transport.HttpTransport
+    :param max_concurrency: maximum number of requests running at the same time
+    """
+
+    def __init__(self, transport, max_concurrency=10):
+        self.transport = transport
+        self._pool = ThreadPool(max_concurrency)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        area = getattr(areas, name)
+        return AsyncArea(area(self.transport), self._pool)
+
+    def __dir__(self):
+        return dir(areas)
+
+    def close(self):
+        """Wait for the running requests and stop the pool"""
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def gather(results, timeout=None):
+    """
+    Wait for several AsyncResult and return their values in the same order.
+    The first error is raised.
+    """
+    return [result.get(timeout) for result in results]
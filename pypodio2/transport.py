@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
-from httplib2 import Http
+import random
+import socket
+import threading
+import time
+from httplib2 import Http, HttpLib2Error
 
 try:
-    from urllib.parse import urlencode
+    from urllib.parse import urlencode, urlparse
 except ImportError:
     from urllib import urlencode
+    from urlparse import urlparse
 
 from .encode import multipart_encode
 
@@ -14,6 +19,149 @@ except ImportError:
     import simplejson as json
 
 
+class HttpPool(object):
+    """
+    Pool of httplib2.Http objects (each keeping its connections alive) shared by transports and threads.
+
+    :param max_size: maximum number of requests running at the same time, and of Http objects kept
+    :param idle_timeout: number of seconds after which an unused Http object and its connections are closed
+    :param per_host: maximum number of requests running at the same time against one host
+    :param timeout: number of seconds a connection waits for the server before the request fails (None: forever)
+    """
+
+    def __init__(self, max_size=10, idle_timeout=60, per_host=4, timeout=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.per_host = min(per_host, max_size)
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._host_slots = {}
+
+    def request(self, uri, method="GET", body=None, headers=None):
+        """Same as httplib2.Http.request, using a connection from the pool"""
+        with self._get_host_slots(urlparse(uri).netloc):
+            with self._slots:
+                http = self._acquire()
+                try:
+                    return http.request(uri, method, body=body, headers=headers)
+                finally:
+                    self._release(http)
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for last_used, http in idle:
+            _close_http(http)
+
+    def _get_host_slots(self, host):
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _acquire(self):
+        expired = []
+        now = time.time()
+        http = None
+        with self._lock:
+            # the oldest ones are at the start of the list
+            while self._idle and now - self._idle[0][0] > self.idle_timeout:
+                expired.append(self._idle.pop(0)[1])
+            if self._idle:
+                http = self._idle.pop()[1]
+        for old_http in expired:
+            _close_http(old_http)
+        if http is None:
+            http = Http(timeout=self.timeout, disable_ssl_certificate_validation=True)
+        return http
+
+    def _release(self, http):
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((time.time(), http))
+                return
+        _close_http(http)
+
+
+def _close_http(http):
+    for connection in list(http.connections.values()):
+        connection.close()
+    http.connections.clear()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """Return the HttpPool shared by the transports created without a pool"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = HttpPool()
+        return _default_pool
+
+
+class RateLimiter(object):
+    """
+    Token bucket pacing the requests made with one set of credentials, fed by Podio's rate limit headers.
+
+    As long as Podio did not report its limits, requests are not paced. Afterwards, the bucket holds the
+    remaining requests minus a reserve of (1 - budget) of the limit, and refills at budget * limit per period.
+
+    :param budget: share of Podio's limit we allow ourselves to use
+    :param period: number of seconds Podio's limit applies to
+    """
+
+    def __init__(self, budget=0.95, period=3600):
+        self.budget = budget
+        self.period = period
+        self._lock = threading.Lock()
+        self._rate = None
+        self._tokens = 0.0
+        self._updated = time.time()
+
+    def _refill(self, now):
+        if self._rate:
+            self._tokens += (now - self._updated) * self._rate
+        self._updated = now
+
+    def acquire(self):
+        """Wait until a request can be made"""
+        while True:
+            with self._lock:
+                if self._rate is None:
+                    return
+                self._refill(time.time())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def update(self, response):
+        """Read the rate limit headers of a response"""
+        try:
+            limit = int(response['x-rate-limit-limit'])
+            remaining = int(response['x-rate-limit-remaining'])
+        except (KeyError, ValueError):
+            return
+        with self._lock:
+            self._rate = limit * self.budget / float(self.period)
+            self._updated = time.time()
+            self._tokens = max(0.0, remaining - limit * (1 - self.budget))
+
+    def exhausted(self):
+        """Podio refused a request because of its rate limit: stop until the bucket refills"""
+        with self._lock:
+            if self._rate is not None:
+                self._tokens = min(self._tokens, 0.0)
+                self._updated = time.time()
+
+
 class OAuthToken(object):
     """
     Class used to encapsulate the OAuthToken required to access the
@@ -26,43 +174,125 @@ class OAuthToken(object):
         self.expires_in = resp['expires_in']
         self.access_token = resp['access_token']
         self.refresh_token = resp['refresh_token']
+        # tokens rebuilt from to_dict() keep their original expiry time
+        self.expires_at = resp.get('expires_at', time.time() + self.expires_in)
+
+    def expires_soon(self, margin=0):
+        return time.time() + margin >= self.expires_at
+
+    def to_dict(self):
+        return {'expires_in': self.expires_in,
+                'expires_at': self.expires_at,
+                'access_token': self.access_token,
+                'refresh_token': self.refresh_token}
 
     def to_headers(self):
         return {'authorization': "OAuth2 %s" % self.access_token}
 
 
+def _request_token(domain, body, pool=None):
+    h = pool or default_pool()
+    headers = {'content-type': 'application/x-www-form-urlencoded'}
+    response, data = h.request(domain + "/oauth/token", "POST",
+                               urlencode(body), headers=headers)
+    return OAuthToken(_handle_response(response, data))
+
+
 class OAuthAuthorization(object):
-    """Generates headers for Podio OAuth2 Authorization"""
-
-    def __init__(self, login, password, key, secret, domain):
-        body = {'grant_type': 'password',
-                'client_id': key,
-                'client_secret': secret,
-                'username': login,
-                'password': password}
-        h = Http(disable_ssl_certificate_validation=True)
-        headers = {'content-type': 'application/x-www-form-urlencoded'}
-        response, data = h.request(domain + "/oauth/token", "POST",
-                                   urlencode(body), headers=headers)
-        self.token = OAuthToken(_handle_response(response, data))
+    """
+    Generates headers for Podio OAuth2 Authorization
+
+    If a token is given, it is used instead of logging in. The token is refreshed once it expires within
+    refresh_margin seconds, on_refresh(token) being called with the new one. A token rejected by Podio is
+    refreshed as well (see rejected), on_reject(token) being called with the rejected one.
+    """
+
+    def __init__(self, login, password, key, secret, domain, pool=None, token=None, refresh_margin=300,
+                 on_refresh=None, on_reject=None):
+        self._login = login
+        self._password = password
+        self._key = key
+        self._secret = secret
+        self._domain = domain
+        self._pool = pool
+        self._lock = threading.Lock()
+        self.refresh_margin = refresh_margin
+        self.on_refresh = on_refresh
+        self.on_reject = on_reject
+        self.token = token
+        if self.token is None:
+            self.token = self._password_token()
+
+    def _password_token(self):
+        return _request_token(self._domain,
+                              {'grant_type': 'password',
+                               'client_id': self._key,
+                               'client_secret': self._secret,
+                               'username': self._login,
+                               'password': self._password},
+                              self._pool)
+
+    def _new_token(self, token):
+        try:
+            return _request_token(self._domain,
+                                  {'grant_type': 'refresh_token',
+                                   'client_id': self._key,
+                                   'client_secret': self._secret,
+                                   'refresh_token': token.refresh_token},
+                                  self._pool)
+        except TransportException:
+            return self._password_token()
+
+    def refresh(self):
+        """Get a new token with the refresh token, logging in again if it is not accepted anymore"""
+        with self._lock:
+            token = self._new_token(self.token)
+            self.token = token
+        if self.on_refresh is not None:
+            self.on_refresh(token)
+        return token
+
+    def rejected(self, headers):
+        """
+        Podio refused the token sent with these headers (revoked, or replaced by a refresh made elsewhere):
+        get a new one, unless another request already did
+        """
+        with self._lock:
+            token = self.token
+            if headers.get('authorization') != token.to_headers()['authorization']:
+                return
+            if self.on_reject is not None:
+                self.on_reject(token)
+            token = self._new_token(token)
+            self.token = token
+        if self.on_refresh is not None:
+            self.on_refresh(token)
 
     def __call__(self):
-        return self.token.to_headers()
+        token = self.token
+        if token.expires_soon(self.refresh_margin):
+            token = self.refresh()
+        return token.to_headers()
 
 
 class OAuthAppAuthorization(object):
 
-    def __init__(self, app_id, app_token, key, secret, domain):
-        body = {'grant_type': 'app',
-                'client_id': key,
-                'client_secret': secret,
-                'app_id': app_id,
-                'app_token': app_token}
-        h = Http(disable_ssl_certificate_validation=True)
-        headers = {'content-type': 'application/x-www-form-urlencoded'}
-        response, data = h.request(domain + "/oauth/token", "POST",
-                                   urlencode(body), headers=headers)
-        self.token = OAuthToken(_handle_response(response, data))
+    def __init__(self, app_id, app_token, key, secret, domain, pool=None):
+        self._body = {'grant_type': 'app',
+                      'client_id': key,
+                      'client_secret': secret,
+                      'app_id': app_id,
+                      'app_token': app_token}
+        self._domain = domain
+        self._pool = pool
+        self._lock = threading.Lock()
+        self.token = _request_token(domain, self._body, pool)
+
+    def rejected(self, headers):
+        """Podio refused the token sent with these headers: get a new one, unless another request already did"""
+        with self._lock:
+            if headers.get('authorization') == self.token.to_headers()['authorization']:
+                self.token = _request_token(self._domain, self._body, self._pool)
 
     def __call__(self):
         return self.token.to_headers()
@@ -100,111 +330,193 @@ class TransportException(Exception):
         return "TransportException(%s): %s" % (self.status, self.content)
 
 
+class RequestBuilder(object):
+    """
+    Immutable request being built by chaining attributes on a transport, such as transport.GET.item[12](),
+    each step returning a new builder. Calling it sends the request.
+    """
+
+    def __init__(self, transport, method="GET", attribute_stack=()):
+        self._transport = transport
+        self._method = method
+        self._attribute_stack = attribute_stack
+
+    def __call__(self, *args, **kwargs):
+        return self._transport.request(self._method,
+                                       self._attribute_stack + tuple(str(a) for a in args),
+                                       kwargs)
+
+    def __getitem__(self, name):
+        return RequestBuilder(self._transport, self._method, self._attribute_stack + (str(name),))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in self._transport.supported_methods:
+            return RequestBuilder(self._transport, name, self._attribute_stack)
+        elif not name.endswith(')'):
+            return RequestBuilder(self._transport, self._method, self._attribute_stack + (name,))
+        return self
+
+
 class HttpTransport(object):
-    def __init__(self, url, headers_factory):
+    """
+    Builds and sends the requests to the API.
+
+    The transport only holds its configuration: every request is built from its own RequestBuilder, so one
+    transport (and the client using it) can be shared by several threads.
+
+    Requests are paced by rate_limiter (a RateLimiter, one is created if None). Requests refused because of the
+    rate limit are retried, as well as GET requests and requests called with idempotent=True that failed with a
+    server or network error, waiting a random time growing exponentially with each attempt (up to max_retries).
+    A request refused because Podio does not accept the token anymore is retried once, after
+    authorization.rejected(headers) got a new token.
+    """
+    supported_methods = ("GET", "POST", "PUT", "HEAD", "DELETE",)
+    retry_statuses = (500, 502, 503, 504)
+    rate_limit_statuses = (420, 429)
+
+    def __init__(self, url, headers_factory, pool=None, rate_limiter=None, max_retries=5, backoff=1, max_backoff=60,
+                 authorization=None):
         self._api_url = url
         self._headers_factory = headers_factory
-        self._supported_methods = ("GET", "POST", "PUT", "HEAD", "DELETE",)
-        self._attribute_stack = []
-        self._method = "GET"
-        self._posts = []
-        self._http = Http(disable_ssl_certificate_validation=True)
-        self._params = {}
+        self._authorization = authorization
+        self._http = pool or default_pool()
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
         self._url_template = '%(domain)s/%(generated_url)s'
         self._stack_collapser = "/".join
         self._params_template = '?%s'
 
     def __call__(self, *args, **kwargs):
-        self._attribute_stack += [str(a) for a in args]
-        self._params = kwargs
-
-        headers = self._headers_factory()
+        return RequestBuilder(self)(*args, **kwargs)
 
-        if 'url' not in kwargs:
-            url = self.get_url()
-        else:
-            url = self.get_url(kwargs['url'])
+    def __getitem__(self, name):
+        return RequestBuilder(self)[name]
 
-        if (self._method == "POST" or self._method == "PUT") and 'type' not in kwargs:
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(RequestBuilder(self), name)
+
+    def request(self, method, attribute_stack, kwargs):
+        """
+        Send a request and return the handled response
+        :param method: HTTP method
+        :param attribute_stack: parts of the URL, used if kwargs has no url
+        :param kwargs: parameters of the request (url, body, type, GET, handler, idempotent or query parameters)
+        """
+        params = dict(kwargs)
+        idempotent = params.pop('idempotent', method in ('GET', 'HEAD'))
+        # request specific headers, added to the ones of the headers factory
+        headers = {}
+
+        url = self.get_url(method, attribute_stack, params, params.pop('url', None))
+
+        if (method == "POST" or method == "PUT") and 'type' not in params:
             headers.update({'content-type': 'application/json'})
             # Not sure if this will always work, but for validate/verfiy nothing else was working:
-            body = json.dumps(kwargs)
-        elif 'type' in kwargs:
-            if kwargs['type'] == 'multipart/form-data':
-                body, new_headers = multipart_encode(kwargs['body'])
+            body = json.dumps(params)
+        elif 'type' in params:
+            if params['type'] == 'multipart/form-data':
+                body, new_headers = multipart_encode(params['body'])
                 body = "".join(body)
                 headers.update(new_headers)
             else:
-                body = kwargs['body']
-                headers.update({'content-type': kwargs['type']})
+                body = params['body']
+                headers.update({'content-type': params['type']})
         else:
-            body = self._generate_body()  # hack
-        response, data = self._http.request(url, self._method, body=body, headers=headers)
-
-        self._attribute_stack = []
-        handler = kwargs.get('handler', _handle_response)
+            body = self._generate_body(method, params)  # hack
+
+        attempt = 0
+        reauthorized = False
+        while True:
+            response = None
+            self._rate_limiter.acquire()
+            request_headers = self._headers_factory()
+            request_headers.update(headers)
+            try:
+                response, data = self._http.request(url, method, body=body, headers=request_headers)
+            except (socket.error, HttpLib2Error):
+                if not idempotent or attempt >= self._max_retries:
+                    raise
+            else:
+                if not reauthorized and self._authorization is not None and _is_invalid_token(response, data):
+                    self._authorization.rejected(request_headers)
+                    reauthorized = True
+                    continue
+                self._rate_limiter.update(response)
+                if response.status in self.rate_limit_statuses:
+                    self._rate_limiter.exhausted()
+                retry = response.status in self.rate_limit_statuses or (
+                    idempotent and response.status in self.retry_statuses)
+                if not retry or attempt >= self._max_retries:
+                    break
+            time.sleep(self._get_delay(attempt, response))
+            attempt += 1
+
+        handler = params.get('handler', _handle_response)
         return handler(response, data)
 
+    def _get_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt, Retry-After if Podio sent it, a jittered backoff otherwise"""
+        if response is not None and 'retry-after' in response:
+            try:
+                return min(float(response['retry-after']), self._max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self._max_backoff, self._backoff * 2 ** attempt))
+
     def _generate_params(self, params):
         body = self._params_template % urlencode(params)
         if body is None:
             return ''
         return body
 
-    def _generate_body(self):
-        if self._method == 'POST':
-            internal_params = self._params.copy()
+    def _generate_body(self, method, params):
+        if method == 'POST':
+            internal_params = params.copy()
 
             if 'GET' in internal_params:
                 del internal_params['GET']
 
             return self._generate_params(internal_params)[1:]
 
-    def _clear_content_type(self):
-        """Clear content-type"""
-        if 'content-type' in self._headers:
-            del self._headers['content-type']
-
-    def _clear_headers(self):
-        """Clear all headers"""
-        self._headers = {}
-
-    def get_url(self, url=None):
+    def get_url(self, method, attribute_stack, params, url=None):
         if url is None:
             url = self._url_template % {
                 "domain": self._api_url,
-                "generated_url": self._stack_collapser(self._attribute_stack),
+                "generated_url": self._stack_collapser(attribute_stack),
             }
         else:
             url = self._url_template % {
                 'domain': self._api_url,
                 'generated_url': url[1:]
             }
-            del self._params['url']
 
-        if len(self._params):
-            internal_params = self._params.copy()
+        if len(params):
+            internal_params = params.copy()
 
             if 'handler' in internal_params:
                 del internal_params['handler']
 
-            if self._method == 'POST' or self._method == "PUT":
+            if method == 'POST' or method == "PUT":
                 if "GET" not in internal_params:
                     return url
                 internal_params = internal_params['GET']
             url += self._generate_params(internal_params)
         return url
 
-    def __getitem__(self, name):
-        self._attribute_stack.append(name)
-        return self
 
-    def __getattr__(self, name):
-        if name in self._supported_methods:
-            self._method = name
-        elif not name.endswith(')'):
-            self._attribute_stack.append(name)
-        return self
+def _is_invalid_token(response, data):
+    if response.status != 401:
+        return False
+    try:
+        return json.loads(data.decode("utf-8")).get('error') == 'invalid_token'
+    except (AttributeError, ValueError):
+        return False
 
 
 def _handle_response(response, data):